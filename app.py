@@ -1,24 +1,97 @@
 
 import os
 import shutil
+import uuid
+import hashlib
 import aiofiles
-from fastapi import FastAPI, UploadFile, File, HTTPException
-import io
+import aiofiles.os
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, UploadFile, File, HTTPException, Response, Request, Query
 import zipfile
-from openpyxl import Workbook
-from fastapi.responses import FileResponse, StreamingResponse
+import tempfile
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from fastapi import BackgroundTasks
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from typing import List
+from typing import List, Optional
+from pydantic import BaseModel
 import re
 import logging
 
 # Import refactored logic
-from main import process_invoices, scan_directory, INPUT_DIR, OUTPUT_FILE
+from main import setup_logging, process_invoices, scan_directory, scan_roots, resolve_path, key_excluded, split_page_key, get_index, organized_target, INVOICE_EXTENSIONS, INPUT_DIR, OUTPUT_FILE, UNKNOWN_PURCHASER
+from jobs import scan_jobs
+from organizer import organize
+from zipstream import iter_zip
+from live_index import LiveIndex, SORT_KEYS, PROGRESS_INTERVAL
+from summary import write_summary, FORMATS as SUMMARY_FORMATS
+import metrics
+
+# How long GET /api/invoices waits for its scan before returning partial results
+INVOICES_WAIT = float(os.environ.get("LAZYFP_INVOICES_WAIT", 2.0))
+
+# Uploads are copied to disk in pieces of this size, never held whole in memory
+UPLOAD_CHUNK_SIZE = int(os.environ.get("LAZYFP_UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+# Largest page GET /api/invoices serves at once
+MAX_PAGE_SIZE = int(os.environ.get("LAZYFP_MAX_PAGE_SIZE", 1000))
+
+# Blocking work (parsing, pandas, file copies, openpyxl) runs on a bounded
+# thread pool. At most HEAVY_CONCURRENCY heavy jobs (scan/organize/export)
+# run at once, so some threads always stay free for cheap requests.
+BLOCKING_WORKERS = int(os.environ.get("LAZYFP_BLOCKING_WORKERS", 8))
+HEAVY_CONCURRENCY = int(os.environ.get("LAZYFP_HEAVY_CONCURRENCY", 2))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="lazyfp")
+_heavy_limit = min(HEAVY_CONCURRENCY, max(BLOCKING_WORKERS - 1, 1))
+_heavy_slots = asyncio.Semaphore(_heavy_limit)
+
+async def run_blocking(fn, *args, heavy=False, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the bounded executor and awaits the result.
+    heavy=True queues behind the heavy-job limit.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(fn, *args, **kwargs)
+    if not heavy:
+        return await loop.run_in_executor(_executor, call)
+    async with _heavy_slots:
+        return await loop.run_in_executor(_executor, call)
+
+# In-memory invoice view kept current by the filesystem watcher and scan jobs
+live_index = LiveIndex(INPUT_DIR)
+scan_jobs.subscribe(live_index)
+
+@asynccontextmanager
+async def lifespan(app):
+    setup_logging()
+    live_index.start()
+    # Initial load (and reconciliation of anything changed while we were down)
+    scan_jobs.start(INPUT_DIR)
+    yield
+    live_index.stop()
 
 # Initialize App
-app = FastAPI(title="LazyFP WebUI")
+app = FastAPI(title="LazyFP WebUI", lifespan=lifespan)
+
+# Request latency histograms for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Queue depths, read when /metrics is scraped
+metrics.gauge("lazyfp_blocking_queue_depth", "Blocking calls waiting for an executor thread.",
+              lambda: _executor._work_queue.qsize())
+metrics.gauge("lazyfp_heavy_jobs_running", "Heavy jobs (scan/organize/export) holding a slot.",
+              lambda: _heavy_limit - _heavy_slots._value)
+metrics.gauge("lazyfp_ingest_pending", "Uploaded files waiting for extraction.",
+              lambda: live_index.ingest_queue.pending_count())
+metrics.gauge("lazyfp_scan_jobs_running", "Background scan jobs currently running.",
+              lambda: sum(1 for job in scan_jobs.jobs() if not job.finished))
+metrics.gauge("lazyfp_event_subscribers", "Clients connected to the /api/events stream.",
+              lambda: live_index.events.subscribers)
 
 # CORS (Allow all for local dev)
 app.add_middleware(
@@ -42,305 +115,523 @@ if not os.path.exists("static"):
 async def read_root():
     return FileResponse("static/index.html")
 
+def _to_records(data_list):
+    """
+    Aggregates raw scan records into the JSON list served to the UI.
+    """
+    df = process_invoices(INPUT_DIR, data_list=data_list)
+    if df.empty:
+        return []
+    # Convert NaN to None for JSON compatibility
+    return df.where(pd.notnull(df), None).to_dict(orient="records")
+
+async def _wait_job(job, timeout):
+    """
+    Waits up to timeout seconds for a scan job without blocking the event loop.
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not job.finished and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.05)
+    return job.finished
+
+def _get_job(job_id):
+    job = scan_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job
+
 @app.get("/api/invoices")
-async def get_invoices():
+async def get_invoices(
+    request: Request,
+    page: Optional[int] = Query(None, ge=1),
+    page_size: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    purchaser: Optional[str] = None,
+    quarter: Optional[str] = None,
+    seller: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    q: Optional[str] = None,
+    sort: Optional[str] = None,
+):
     """
-    Returns the processed list of invoices.
+    Returns the processed list of invoices from the live index snapshot.
+    Optional filters (purchaser, quarter, seller, amount range, q = text
+    search), sort (a column, "-" prefixed for descending) and page/page_size
+    narrow the list; X-Total-Count carries the number of matches.
+    Responses carry an ETag tied to the index version: a matching
+    If-None-Match returns 304 without a body.
+    With the watcher off, a reconciliation scan is started (or joined) first
+    and awaited for up to INVOICES_WAIT seconds. While a scan is still
+    running, the X-Scan-Job header carries the job id to poll; while uploads
+    are still being extracted, X-Ingest-Pending carries their count.
+    X-Index-Version is the index version the rows reflect (see /api/events).
     """
+    if sort is not None and sort.lstrip("-") not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SORT_KEYS)} (optionally '-' prefixed)")
+    filters = {"purchaser": purchaser, "quarter": quarter, "seller": seller,
+               "min_amount": min_amount, "max_amount": max_amount, "search": q, "sort": sort}
+    offset, limit = ((page - 1) * page_size, page_size) if page is not None else (0, None)
+
     try:
-        df = process_invoices(INPUT_DIR)
-        if df.empty:
-            return []
-        
-        # Convert NaN to None for JSON compatibility
-        records = df.where(pd.notnull(df), None).to_dict(orient="records")
-        return records
+        if live_index.watching:
+            job = scan_jobs.running(INPUT_DIR)
+        else:
+            job = scan_jobs.start(INPUT_DIR)
+            await _wait_job(job, INVOICES_WAIT)
+
+        headers = {}
+        if job is not None and not job.finished:
+            headers["X-Scan-Job"] = job.id
+        pending = live_index.ingest_queue.pending_count()
+        if pending:
+            headers["X-Ingest-Pending"] = str(pending)
+
+        # Same index version + same query = same body
+        query_tag = hashlib.sha1(repr((offset, limit, sorted(filters.items()))).encode()).hexdigest()[:12]
+        if request.headers.get("if-none-match") == _etag(live_index.version, query_tag):
+            headers["X-Index-Version"] = str(live_index.version)
+            return Response(status_code=304, headers=dict(headers, ETag=_etag(live_index.version, query_tag)))
+
+        version, total, body = await run_blocking(live_index.query, offset, limit, **filters)
+        headers["ETag"] = _etag(version, query_tag)
+        headers["X-Index-Version"] = str(version)
+        headers["X-Total-Count"] = str(total)
+        return Response(body, media_type="application/json", headers=headers)
     except Exception as e:
         logging.error(f"Error fetching invoices: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Index versions restart at 0 with the process; keep old ETags from matching
+_ETAG_EPOCH = uuid.uuid4().hex[:8]
+
+def _etag(version, query_tag):
+    return f'"{_ETAG_EPOCH}-{version}-{query_tag}"'
+
+@app.get("/api/events")
+async def stream_events(request: Request):
+    """
+    Server-sent events of index changes, so clients patch their list instead
+    of refetching it: "change" (files added/updated/removed plus the delta of
+    the grouped rows they touched), "duplicates", "scan" and "organize"
+    progress. Every event carries an id; a client reconnecting with
+    Last-Event-ID gets what it missed, or "resync" when that is gone.
+    """
+    return StreamingResponse(
+        live_index.events.stream(request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Service metrics in the Prometheus text exposition format.
+    """
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/api/scan")
 async def scan_invoices():
     """
-    Triggers a fresh scan and returns the result.
+    Starts a background scan (or joins the running one) and returns its progress.
+    """
+    job = scan_jobs.start(INPUT_DIR)
+    return JSONResponse(job.progress(), status_code=202)
+
+@app.get("/api/scan/{job_id}")
+async def scan_progress(job_id: str):
+    """
+    Reports files done/remaining, parse rate and ETA of a scan job.
+    """
+    return _get_job(job_id).progress()
+
+@app.get("/api/scan/{job_id}/results")
+async def scan_results(job_id: str):
+    """
+    Returns the invoices resolved so far by a scan job (partial while running).
+    """
+    return await run_blocking(_to_records, _get_job(job_id).snapshot_records(), heavy=True)
+
+@app.delete("/api/scan/{job_id}")
+async def cancel_scan(job_id: str):
+    """
+    Cancels a running scan job. Files parsed so far stay indexed.
+    """
+    job = _get_job(job_id)
+    job.cancel()
+    return job.progress()
+
+@app.get("/api/quarantine")
+async def list_quarantine():
+    """
+    Lists the files extraction gave up on (timeout, memory cap, crashed
+    worker) and why. Scans skip them until their content changes.
+    """
+    entries = await run_blocking(lambda: get_index().quarantine_entries())
+    return [{"path": path, "digest": digest, "reason": reason, "quarantined_at": at}
+            for path, digest, reason, at in entries]
+
+@app.delete("/api/quarantine")
+async def release_quarantine():
     """
-    return await get_invoices()
+    Releases every quarantined file and starts a scan that retries them.
+    """
+    released = await run_blocking(lambda: get_index().release_quarantine())
+    job = scan_jobs.start(INPUT_DIR) if released else None
+    return {"released": released, "scan": job.progress() if job else None}
 
 @app.post("/api/upload")
 async def upload_files(files: List[UploadFile] = File(...)):
     """
-    Uploads PDF files to the input directory.
+    Uploads invoice files (PDF, XML, OFD) to the input directory.
+    Each file is streamed to disk in UPLOAD_CHUNK_SIZE pieces and hashed on
+    the way, then queued for background extraction.
     """
     uploaded_counts = 0
     for file in files:
-        if not file.filename.lower().endswith(".pdf"):
+        if not file.filename.lower().endswith(INVOICE_EXTENSIONS):
             continue
-            
-        file_path = os.path.join(INPUT_DIR, file.filename)
+
+        safe_name = os.path.basename(file.filename)
+        file_path = os.path.join(INPUT_DIR, safe_name)
+        # Hidden temp name with no invoice extension: scans and the watcher ignore partial files
+        tmp_path = os.path.join(INPUT_DIR, f".{safe_name}.{uuid.uuid4().hex[:8]}.part")
         try:
-            async with aiofiles.open(file_path, 'wb') as out_file:
-                content = await file.read()
-                await out_file.write(content)
+            digest = hashlib.sha256()
+            async with aiofiles.open(tmp_path, 'wb') as out_file:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    await out_file.write(chunk)
+            await aiofiles.os.replace(tmp_path, file_path)
             uploaded_counts += 1
+            live_index.ingest(safe_name, digest.hexdigest())
         except Exception as e:
             logging.error(f"Failed to upload {file.filename}: {e}")
-            
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
     return {"message": f"Successfully uploaded {uploaded_counts} files"}
 
-@app.delete("/api/invoices/{filename}")
+@app.delete("/api/invoices/{filename:path}")
 async def delete_invoice(filename: str):
     """
     Deletes a specific PDF file.
     Note: The filename provided might be a comma-separated list if grouped, 
     but for deletion we usually expect a single file or a specific target.
     Logic: If it's a single file, delete it.
+    filename is the file's key: its path relative to its scan root.
     """
-    # Security check: simple sanitize
-    safe_name = os.path.basename(filename)
-    path = os.path.join(INPUT_DIR, safe_name)
+    # Security check: the key must stay inside its root
+    safe_name = filename.replace("\\", "/").strip("/")
+    base, page = split_page_key(safe_name)
+    if page > 1:
+        raise HTTPException(status_code=400, detail=f"Invoice is page {page} of {base}; delete that file instead")
+    try:
+        path = resolve_path(INPUT_DIR, safe_name)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid file path")
+    if key_excluded(safe_name):
+        raise HTTPException(status_code=404, detail="File not found")
     
     if os.path.exists(path):
         try:
-            os.remove(path)
+            await run_blocking(os.remove, path)
+            await run_blocking(live_index.refresh, [safe_name])
             return {"message": f"Deleted {safe_name}"}
         except Exception as e:
              raise HTTPException(status_code=500, detail=str(e))
     else:
         raise HTTPException(status_code=404, detail="File not found")
 
+class BulkSelection(BaseModel):
+    """
+    Files a bulk operation applies to: explicit keys in `files`, or else
+    every invoice matching the filters (same meaning as GET /api/invoices).
+    """
+    files: Optional[List[str]] = None
+    purchaser: Optional[str] = None
+    quarter: Optional[str] = None
+    seller: Optional[str] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    q: Optional[str] = None
+
+BULK_ACTIONS = ["delete", "dump", "reextract", "organize"]
+
+def _bulk_targets(selection):
+    """
+    Resolves a selection to ({file key: record keys selected in it}, skipped [{file, reason}]).
+    """
+    if selection.files is not None:
+        keys = [f.replace("\\", "/").strip("/") for f in selection.files]
+    else:
+        filters = {"purchaser": selection.purchaser, "quarter": selection.quarter, "seller": selection.seller,
+                   "min_amount": selection.min_amount, "max_amount": selection.max_amount, "search": selection.q}
+        if all(v is None for v in filters.values()):
+            raise HTTPException(status_code=400, detail="Give files or at least one filter")
+        keys = [key for row in live_index.select(**filters) for key in row["filename"].split(", ")]
+
+    targets, skipped = {}, []
+    for key in keys:
+        base, _ = split_page_key(key)
+        try:
+            resolve_path(INPUT_DIR, base)
+        except ValueError:
+            skipped.append({"file": key, "reason": "invalid path"})
+            continue
+        if key_excluded(base):
+            skipped.append({"file": key, "reason": "not found"})
+            continue
+        targets.setdefault(base, set()).add(key)
+    return targets, skipped
+
+def _bulk(action, selection):
+    """
+    Applies one action to a selection of files with a single re-index, and
+    returns the outcome plus the delta of the grouped rows it changed.
+    delete/dump act on whole files: a multi-invoice PDF selected only
+    through later pages is skipped, like DELETE /api/invoices/{key}.
+    """
+    targets, skipped = _bulk_targets(selection)
+    done, errors = [], []
+    result = {"action": action}
+
+    for fname in sorted(targets):
+        if action in ("delete", "dump") and fname not in targets[fname]:
+            page = min(split_page_key(k)[1] for k in targets[fname])
+            skipped.append({"file": fname, "reason": f"only page {page} selected; select the file itself"})
+        elif not os.path.exists(resolve_path(INPUT_DIR, fname)):
+            skipped.append({"file": fname, "reason": "not found"})
+        else:
+            done.append(fname)
+    before = live_index.group_keys(done)
+
+    if action in ("delete", "dump"):
+        moved = []
+        for fname in done:
+            try:
+                if action == "delete":
+                    os.remove(resolve_path(INPUT_DIR, fname))
+                else:
+                    _move_to_dump(fname)
+                moved.append(fname)
+            except Exception as e:
+                logging.error(f"Failed to {action} {fname}: {e}")
+                errors.append({"file": fname, "error": str(e)})
+        done = moved
+        if done:
+            live_index.refresh(done)
+    elif action == "reextract" and done:
+        live_index.refresh(done, force=True)
+    elif action == "organize" and done:
+        result["organize"] = _organize(only=[resolve_path(INPUT_DIR, f) for f in done])
+
+    delta = live_index.delta(before | live_index.group_keys(done))
+    result.update(files=done, skipped=skipped, errors=errors, delta=delta)
+    return result
+
+@app.post("/api/bulk/{action}")
+async def bulk_action(action: str, selection: BulkSelection):
+    """
+    Runs one action over many files in a single round trip:
+    delete, dump (move to 'dump/'), reextract (re-parse even if indexed,
+    quarantined files included) or organize (only the selected files).
+    The body names the files (keys) or filters selecting them. The index
+    is updated once; the response carries the changed grouped rows as a
+    delta ({"version", "rows", "removed"}) to patch the client's list.
+    """
+    if action not in BULK_ACTIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown bulk action; expected one of {', '.join(BULK_ACTIONS)}")
+    return await run_blocking(_bulk, action, selection, heavy=True)
+
 @app.post("/api/deduplicate")
 async def deduplicate_invoices():
     """
     Moves duplicate invoices to the 'dump' folder, keeping one copy.
     """
-    import shutil
-    
-    df = process_invoices(INPUT_DIR)
-    if df.empty:
+    return await run_blocking(_deduplicate, heavy=True)
+
+def _deduplicate():
+    # Without the watcher the live index may be behind: reconcile first
+    if not live_index.watching:
+        live_index.load(scan_directory(INPUT_DIR))
+
+    groups = live_index.duplicate_groups()
+    if not groups and not live_index.rows():
         return {"message": "No invoices to process.", "moved_count": 0}
         
-    dump_dir = os.path.join(INPUT_DIR, "dump")
-    if not os.path.exists(dump_dir):
-        os.makedirs(dump_dir)
-        
     moved_count = 0
+    moved = []
     
-    # Iterate over grouped data
-    # The process_invoices already groups by invoice_no.
-    # We need to find groups where 'count' > 1.
-    # However, process_invoices returns aggregated string for filename "a.pdf, b.pdf".
-    
-    duplicates = df[df["count"] > 1]
-    
-    for _, row in duplicates.iterrows():
-        filenames = row["filename"].split(", ")
-        # Keep the first one, move the rest
-        to_move = filenames[1:]
-        
-        for fname in to_move:
-            src = os.path.join(INPUT_DIR, fname)
-            dst = os.path.join(dump_dir, fname)
-            
-            if os.path.exists(src):
-                try:
-                    # Handle name collision in dump
-                    if os.path.exists(dst):
-                        base, ext = os.path.splitext(fname)
-                        dst = os.path.join(dump_dir, f"{base}_{int(datetime.now().timestamp())}{ext}")
-                        
-                    shutil.move(src, dst)
-                    moved_count += 1
-                except Exception as e:
-                    logging.error(f"Failed to move {fname}: {e}")
-                    
+    # Each group shares an invoice number or identical content: keep the first one, move the rest
+    redundant = {key for filenames in groups for key in filenames[1:]}
+    to_move = []
+    for key in sorted(redundant):
+        fname, page = split_page_key(key)
+        # A multi-invoice PDF moves only when every invoice in it is a duplicate
+        if page == 1 and set(live_index.record_keys(fname)) <= redundant:
+            to_move.append(fname)
+
+    for fname in to_move:
+        if os.path.exists(resolve_path(INPUT_DIR, fname)):
+            try:
+                _move_to_dump(fname)
+                moved_count += 1
+                moved.append(fname)
+            except Exception as e:
+                logging.error(f"Failed to move {fname}: {e}")
+
+    if moved:
+        live_index.refresh(moved)
+
     return {"message": f"Deduplication complete. Moved {moved_count} files to 'dump/'.", "moved_count": moved_count}
 
+def _move_to_dump(fname):
+    """
+    Moves one file (by key) into the 'dump' folder, renaming it on a name collision.
+    """
+    dump_dir = os.path.join(INPUT_DIR, "dump")
+    os.makedirs(dump_dir, exist_ok=True)
+    dst = os.path.join(dump_dir, os.path.basename(fname))
+    # Handle name collision in dump
+    if os.path.exists(dst):
+        base, ext = os.path.splitext(os.path.basename(fname))
+        dst = os.path.join(dump_dir, f"{base}_{int(datetime.now().timestamp())}{ext}")
+    shutil.move(resolve_path(INPUT_DIR, fname), dst)
+
 @app.post("/api/organize")
 async def organize_invoices():
     """
     Organizes processed invoices into folders by Purchaser -> Quarter.
-    Renames files to: {Last6Digits}-{Seller}-{Amount}.pdf
+    Format: {Purchaser}/{Quarter}/{Last6Digits}-{Seller}-{Amount}.pdf
+    Only new or changed invoices are placed (hardlink/reflink when possible).
     """
-    import shutil
-    
-    # Get RAW data for all files
-    data_list = scan_directory(INPUT_DIR)
-    
-    organized_base = os.path.join(INPUT_DIR, "organized")
-    if not os.path.exists(organized_base):
-        os.makedirs(organized_base)
-        
-    count = 0
-    errors = 0
-    
-    for item in data_list:
-        try:
-            filename = item.get("filename")
-            src_path = os.path.join(INPUT_DIR, filename)
-            
-            if not os.path.exists(src_path):
-                continue
-                
-            # Get metadata
-            purchaser = item.get("purchaser") or "Unknown Purchaser"
-            # Recalculate quarter effectively or rely on what's in item if we put it there?
-            # scan_directory doesn't add 'quarter' column, process_invoices does.
-            # We need to compute it.
-            from main import get_quarter
-            date_str = item.get("date")
-            quarter = get_quarter(str(date_str))
-            
-            seller = item.get("seller") or "Unknown Seller"
-            invoice_no = item.get("invoice_no") or "000000"
-            amount = item.get("total_amount")
-            if amount is not None:
-                amount = f"{float(amount):.2f}"
-            else:
-                amount = "0.00"
-                
-            # Create Target Dir
-            # Clean purchaser name slightly for path safety
-            safe_purchaser = re.sub(r'[\\/*?:"<>|]', "", purchaser).strip()
-            target_dir = os.path.join(organized_base, safe_purchaser, quarter)
-            if not os.path.exists(target_dir):
-                os.makedirs(target_dir)
-                
-            # Format New Filename: Last 6 digits - Seller - Amount
-            # If invoice_no is short, pad with 0? Or just take what we have.
-            # Req: "发票号后6位" (Last 6 digits)
-            # If invalid, "0补足" (pad with 0)
-            
-            # Clean invoice no (digits in item are already extracted string)
-            inv_str = str(invoice_no)
-            if len(inv_str) >= 6:
-                inv_suffix = inv_str[-6:]
-            else:
-                inv_suffix = inv_str.zfill(6)
-            
-            # Safe seller name
-            safe_seller = re.sub(r'[\\/*?:"<>|]', "", seller).strip()
-            
-            new_name = f"{inv_suffix}-{safe_seller}-{amount}.pdf"
-            dst_path = os.path.join(target_dir, new_name)
-            
-            # Copy (preserve original)
-            shutil.copy2(src_path, dst_path)
-            count += 1
-        except Exception as e:
-            logging.error(f"Error organizing {item}: {e}")
-            errors += 1
-            
-    return {"message": f"Organized {count} files.", "errors": errors}
+    return await run_blocking(_organize, heavy=True)
+
+def _organize(only=None):
+    # Progress goes out on the event feed while the request waits for the result
+    events = live_index.events
+    progress = lambda done, total: events.publish(
+        "organize", {"status": "running", "done": done, "total": total}, every=PROGRESS_INTERVAL)
+    try:
+        result = organize(INPUT_DIR, only=only, progress=progress)
+    except Exception as e:
+        events.publish("organize", {"status": "failed", "error": str(e)})
+        raise
+    events.publish("organize", dict(result, status="done"))
+    return result
 
 @app.get("/api/export/{purchaser}/{quarter}")
-async def export_quarter_zip(purchaser: str, quarter: str):
+async def export_quarter_zip(purchaser: str, quarter: str, summary: str = "xlsx"):
     """
-    Exports a ZIP of the organized folder for a specific Purchaser and Quarter.
-    Includes a summary Excel file.
+    Exports a ZIP of the organized invoices for a specific Purchaser and Quarter.
+    Includes a summary file (summary=xlsx, csv or ndjson). The archive is
+    streamed as it is written.
     """
-    import re
+    if summary not in SUMMARY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"summary must be one of: {', '.join(SUMMARY_FORMATS)}")
+    entries, summary_name, summary_path, zip_filename = await run_blocking(
+        _prepare_export, purchaser, quarter, summary, heavy=True
+    )
+    # xlsx is a ZIP already; the text formats compress well
+    compress = zipfile.ZIP_STORED if summary == "xlsx" else zipfile.ZIP_DEFLATED
+    entries.append((summary_name, summary_path, compress))
+
+    # Return (headers for download)
+    from urllib.parse import quote
+    encoded_name = quote(zip_filename)
     
+    # The summary is removed once the response is over, however it ended
+    # (also when the client disconnected before the body started)
+    return StreamingResponse(
+        _count_bytes(_iterate_blocking(iter_zip(entries)), metrics.EXPORT_BYTES),
+        media_type="application/zip", 
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_name}"},
+        background=BackgroundTask(_remove_quietly, summary_path),
+    )
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def _iterate_blocking(gen):
+    """
+    Drives a blocking generator on the bounded executor, one item at a time.
+    """
+    done = object()
+    while True:
+        item = await run_blocking(next, gen, done)
+        if item is done:
+            return
+        yield item
+
+async def _count_bytes(chunks, counter):
+    async for chunk in chunks:
+        counter.inc(len(chunk))
+        yield chunk
+
+def _prepare_export(purchaser, quarter, fmt="xlsx"):
+    """
+    Looks up one purchaser/quarter slice in the index and builds the ZIP
+    entries and summary from that single record set.
+    Each record ships its organized copy when present, else its source PDF
+    under the organized name.
+    Returns (ZIP entries, summary arcname, summary temp file, download filename).
+    The caller removes the temp file.
+    """
     # Path safety
     # We must allow decode because URL params are decoded by FastAPI? Yes.
     # But clean path traversal just in case
     safe_purchaser = re.sub(r'[\\/*?:"<>|]', "", purchaser).strip()
     safe_quarter = re.sub(r'[\\/*?:"<>|]', "", quarter).strip()
-    
-    target_dir = os.path.join(INPUT_DIR, "organized", safe_purchaser, safe_quarter)
-    
-    if not os.path.exists(target_dir):
-        # Maybe user hasn't organized yet, or name mismatch
-        # Fix: Provide clear error
-        raise HTTPException(status_code=400, detail="Folder not found. Please click 'Organize' first.")
-        
-    # Create ZIP in memory
-    mem_zip = io.BytesIO()
-    
-    files_to_zip = [f for f in os.listdir(target_dir) if f.lower().endswith(".pdf")]
-    
-    # Prepare Summary Data
-    summary_data = []
-    total_amount = 0.0
-    
-    with zipfile.ZipFile(mem_zip, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for fname in files_to_zip:
-            fpath = os.path.join(target_dir, fname)
-            zf.write(fpath, arcname=fname)
-            
-            # Parse filename back to summary? 
-            # Or better: Extract info from our cache for these files?
-            # Issue: The organized filenames {Suffix}-{Seller}-{Amount} don't have full info (Date, Full ID).
-            # The user asked for "Quarter Summary".
-            # We can try to re-match the original files or just parse what we can.
-            # Or we can iterate current `process_invoices` data and filter by P/Q matching this export.
-            # Iterating `scan_directory` again is safer to get full metadata.
-            
-            # Parse filename for basic info if needed, but scanning directory allows finding the *original* metadata 
-            # if we can link them? No, inside zip we just have the renamed file.
-            
-            # Better approach: Recalculate summary from `scan_directory(INPUT_DIR)` 
-            # filtering by Purchaser and Quarter.
-            pass
-
-    # Generate Summary Excel
-    # Filter raw data
-    raw_data = scan_directory(INPUT_DIR)
-    from main import get_quarter
-    
+
+    # The UI groups invoices without a purchaser under this label
+    lookup = "" if purchaser in (UNKNOWN_PURCHASER, "Unknown") else purchaser
+    roots = [root for _, root in scan_roots(INPUT_DIR)]
+    matches = get_index().query(purchaser=lookup, quarter=quarter, roots=roots)
+
+    organized_base = os.path.join(INPUT_DIR, "organized")
+    entries = []
     sheet_rows = []
-    
-    for item in raw_data:
-        p = item.get("purchaser") or "Unknown"
-        d = item.get("date")
-        q = get_quarter(str(d))
-        
-        # Match current export target
-        # Do fuzzy match? Or exact? The file structure was created using exact strings from extraction.
-        # So we should match exact.
-        if p == purchaser and q == quarter:
-             amt = float(item.get("total_amount") or 0)
-             total_amount += amt
-             sheet_rows.append({
-                 "Date": d,
-                 "Invoice No": item.get("invoice_no"),
-                 "Seller": item.get("seller"),
-                 "Amount": amt,
-                 "Filename": item.get("filename") # Original filename
-             })
-             
-    # Create Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Summary"
-    ws.append(["Date", "Invoice No", "Seller", "Amount", "Original Filename"])
-    
-    for row in sheet_rows:
-        ws.append([row["Date"], row["Invoice No"], row["Seller"], row["Amount"], row["Filename"]])
-        
-    # Add Total
-    ws.append(["", "", "Total", total_amount, ""])
-    
-    # Save Excel to Zip
-    excel_io = io.BytesIO()
-    wb.save(excel_io)
-    excel_io.seek(0)
-    
-    with zipfile.ZipFile(mem_zip, mode="a", compression=zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr(f"{safe_quarter}_Summary.xlsx", excel_io.getvalue())
-        
-    mem_zip.seek(0)
-    
+    total_amount = 0.0
+    seen = set()
+
+    for src_path, item in matches:
+        _, _, arcname = organized_target(item, os.path.splitext(src_path)[1])
+        # Identical invoices organize onto one file; ship and count it once
+        if arcname in seen:
+            continue
+        seen.add(arcname)
+
+        organized_path = os.path.join(organized_base, safe_purchaser, safe_quarter, arcname)
+        source = organized_path if os.path.exists(organized_path) else src_path
+        if not os.path.exists(source):
+            continue
+        entries.append((arcname, source, zipfile.ZIP_STORED))
+
+        amt = float(item.get("total_amount") or 0)
+        total_amount += amt
+        sheet_rows.append([item.get("date"), item.get("invoice_no"), item.get("seller"), amt,
+                           os.path.basename(src_path)]) # Original filename
+
+    if not entries:
+        raise HTTPException(status_code=400, detail="No invoices found for this purchaser and quarter.")
+
+    # Summary: streamed to a temp file, so large slices never sit in memory as a workbook
+    header = ["Date", "Invoice No", "Seller", "Amount", "Original Filename"]
+    if fmt != "ndjson":
+        sheet_rows.append(["", "", "Total", total_amount, ""])
+    fd, summary_path = tempfile.mkstemp(prefix="lazyfp-summary-", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        write_summary(summary_path, header, sheet_rows, fmt, sheet_name="Summary")
+    except Exception:
+        os.remove(summary_path)
+        raise
+
     zip_filename = f"{safe_purchaser}-{safe_quarter}-{total_amount:.2f}.zip"
-    
-    # Return (headers for download)
-    from urllib.parse import quote
-    encoded_name = quote(zip_filename)
-    
-    return StreamingResponse(
-        mem_zip, 
-        media_type="application/zip", 
-        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_name}"}
-    )
+    return entries, f"{safe_quarter}_Summary.{fmt}", summary_path, zip_filename
 
 # Global import for datetime
 from datetime import datetime
@@ -353,4 +644,5 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Event streams never end on their own: cap how long shutdown waits for them
+    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_graceful_shutdown=5)
@@ -0,0 +1,224 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import logging
+import tempfile
+import resource
+import multiprocessing
+
+import main
+from supervisor import peak_worker_rss_mb
+from zipstream import iter_zip
+from gen_corpus import generate
+from summary import write_summary
+
+PHASES = ["extract", "cold_scan", "warm_scan", "group", "export"]
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def _peak_rss_mb():
+    """
+    Peak RSS of this process and of its busiest worker, in MiB. Supervised
+    extraction workers belong to the fork server and report their own peak;
+    (reaped) children cover in-process pools (LAZYFP_EXTRACT_ISOLATION=0).
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB on Linux
+    return round(own / scale, 1), round(max(children / scale, peak_worker_rss_mb()), 1)
+
+
+def _scan_timed(corpus, workers):
+    """
+    Runs scan_directory; returns when each file completed (a merged PDF
+    reports every invoice it holds, but is stamped once).
+    """
+    stamps = []
+
+    def progress(record, done, total, cached):
+        if done > len(stamps):
+            stamps.append(time.perf_counter())
+
+    main.scan_directory(corpus, workers=workers, progress=progress)
+    return stamps
+
+
+# Each phase returns (files, per-file seconds, seconds of the measured section)
+
+def phase_extract(corpus, workers):
+    # Serial extract_invoice_data: real per-file latency, no index involved
+    latencies = []
+    files = sorted(f for f in os.listdir(corpus) if f.lower().endswith(main.INVOICE_EXTENSIONS))
+    for f in files:
+        t = time.perf_counter()
+        main.extract_invoice_data(os.path.join(corpus, f))
+        latencies.append(time.perf_counter() - t)
+    return len(files), latencies, sum(latencies)
+
+
+def phase_cold_scan(corpus, workers):
+    for path in (main.INDEX_FILE, main.INDEX_FILE + "-wal", main.INDEX_FILE + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    start = time.perf_counter()
+    stamps = _scan_timed(corpus, workers)
+    # Gaps between completions are per-file times only when files finish one
+    # at a time; with several workers they interleave (phase_extract has the latencies)
+    latencies = [b - a for a, b in zip([start] + stamps, stamps)] if workers == 1 else []
+    return len(stamps), latencies, time.perf_counter() - start
+
+
+def phase_warm_scan(corpus, workers):
+    # Indexed files resolve one at a time in this process, whatever `workers` is
+    main.scan_directory(corpus, workers=workers)  # Make sure the index is warm
+    start = time.perf_counter()
+    stamps = _scan_timed(corpus, workers)
+    return len(stamps), [b - a for a, b in zip([start] + stamps, stamps)], time.perf_counter() - start
+
+
+def phase_group(corpus, workers):
+    data_list = main.scan_directory(corpus, workers=workers)
+    start = time.perf_counter()
+    main.process_invoices(corpus, data_list=data_list)
+    return len(data_list), [], time.perf_counter() - start
+
+
+def phase_export(corpus, workers):
+    # Excel summary of the whole corpus plus a streamed ZIP of every PDF
+    data_list = main.scan_directory(corpus, workers=workers)
+    start = time.perf_counter()
+    df = main.process_invoices(corpus, data_list=data_list)
+    summary = io.BytesIO()
+    rows = df[main.SUMMARY_COLUMNS].itertuples(index=False, name=None)
+    write_summary(summary, main.SUMMARY_COLUMNS, rows, sheet_name="Invoices")
+
+    # Record keys of a merged PDF's later pages ("a.pdf#p2") share its file: ship each file once
+    names = list(dict.fromkeys(main.split_page_key(r["filename"])[0] for r in data_list))
+    entries = [(name, main.resolve_path(corpus, name), zipfile.ZIP_STORED) for name in names]
+    entries.append(("Summary.xlsx", summary.getvalue(), zipfile.ZIP_STORED))
+    size = 0
+    for chunk in iter_zip(entries):
+        size += len(chunk)  # Drained like a client download would
+    logging.info(f"Export ZIP: {size / 1024 / 1024:.1f} MiB")
+    return len(names), [], time.perf_counter() - start
+
+
+def _phase_child(name, corpus, workers, index_file, conn):
+    main.INDEX_FILE = index_file
+    main.CACHE_FILE = index_file + ".no-legacy-cache"
+    files, latencies, elapsed = globals()[f"phase_{name}"](corpus, workers)
+    own, children = _peak_rss_mb()
+    conn.send({
+        "phase": name,
+        "files": files,
+        "seconds": round(elapsed, 3),
+        "files_per_sec": round(files / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "peak_rss_mb": own,
+        "peak_worker_rss_mb": children,
+    })
+    conn.close()
+
+
+def run_phase(name, corpus, workers, index_file):
+    """
+    Runs one phase in a fresh process so its peak RSS is its own.
+    """
+    parent, child = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=_phase_child, args=(name, corpus, workers, index_file, child))
+    proc.start()
+    child.close()
+    result = parent.recv()
+    proc.join()
+    return result
+
+
+def accuracy(corpus):
+    """
+    Share of expected fields (from gen_corpus's manifest.json) extracted exactly, per layout.
+    Merged PDFs are scored on every invoice they hold, page by page.
+    """
+    manifest_path = os.path.join(corpus, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    hits, totals = {}, {}
+    for filename, entry in manifest.items():
+        if "copy_of" in entry:
+            continue
+        records = main.extract_invoices(os.path.join(corpus, filename))
+        layout = entry["layout"]
+        for i, expected in enumerate(entry["expected"].get("invoices") or [entry["expected"]]):
+            data = records[i] if i < len(records) else {}
+            for field, value in expected.items():
+                totals[layout] = totals.get(layout, 0) + 1
+                hits[layout] = hits.get(layout, 0) + (data.get(field) == value)
+    return {layout: round(hits[layout] / totals[layout], 3) for layout in totals}
+
+
+def print_table(results):
+    header = f"{'phase':<10} {'files':>7} {'sec':>8} {'files/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'rss MiB':>8} {'workers MiB':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        cells = [r["p50_ms"], r["p99_ms"]]
+        p50, p99 = ("-" if c is None else f"{c:.2f}" for c in cells)
+        print(f"{r['phase']:<10} {r['files']:>7} {r['seconds']:>8.2f} {r['files_per_sec'] or '-':>9} {p50:>8} {p99:>8} "
+              f"{r['peak_rss_mb']:>8} {r['peak_worker_rss_mb']:>12}")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction, scanning, grouping and export.")
+    parser.add_argument("--corpus", help="existing PDF directory (default: generate one in a temp dir)")
+    parser.add_argument("-n", "--count", type=int, default=200, help="files to generate when no corpus is given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=main.SCAN_WORKERS)
+    parser.add_argument("--phases", default=",".join(PHASES), help=f"comma-separated subset of {','.join(PHASES)}")
+    parser.add_argument("--accuracy", action="store_true", help="also score fields against the generated manifest")
+    parser.add_argument("--json", help="write results to this file as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    work = tempfile.mkdtemp(prefix="lazyfp-bench-")
+    try:
+        corpus = args.corpus
+        if corpus is None:
+            corpus = os.path.join(work, "corpus")
+            generate(corpus, args.count, args.seed)
+        index_file = os.path.join(work, "bench_index.db")
+
+        results = []
+        for name in args.phases.split(","):
+            if name not in PHASES:
+                parser.error(f"unknown phase: {name}")
+            logging.info(f"Running phase '{name}'...")
+            results.append(run_phase(name, corpus, args.workers, index_file))
+
+        print_table(results)
+        report = {"workers": args.workers, "phases": results}
+        if args.accuracy:
+            report["accuracy"] = accuracy(corpus)
+            print("Field accuracy by layout:", report["accuracy"])
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,86 @@
+class DuplicateIndex:
+    """
+    Incremental duplicate detection over the files of one directory.
+
+    Every file is filed under its invoice number (when extracted) and its
+    content digest. Keys shared by more than one file are tracked as they
+    change, so listing duplicates costs O(duplicates), not O(files).
+    Byte-identical files are caught even without an invoice number.
+    Not thread-safe: the owner (LiveIndex) serializes access.
+    """
+
+    def __init__(self):
+        self._keys = {}  # filename -> keys it is filed under
+        self._members = {}  # key -> set of filenames
+        self._shared = set()  # keys with more than one member
+
+    @staticmethod
+    def _keys_for(record):
+        keys = []
+        if record.get("invoice_no"):
+            keys.append(("no", record["invoice_no"]))
+        if record.get("digest"):
+            # The invoices of one multi-invoice PDF share its digest, not their content
+            keys.append(("digest", record["digest"], record.get("page", 1)))
+        return keys
+
+    def put(self, filename, record):
+        """
+        Files (record) or forgets (None) one filename.
+        """
+        for key in self._keys.pop(filename, ()):
+            members = self._members[key]
+            members.discard(filename)
+            if len(members) < 2:
+                self._shared.discard(key)
+            if not members:
+                del self._members[key]
+        if record is None:
+            return
+        keys = self._keys_for(record)
+        self._keys[filename] = keys
+        for key in keys:
+            members = self._members.setdefault(key, set())
+            members.add(filename)
+            if len(members) > 1:
+                self._shared.add(key)
+
+    def peers(self, filename):
+        """
+        Sorted other filenames sharing an invoice number or content with filename.
+        """
+        names = set()
+        for key in self._keys.get(filename, ()):
+            if key in self._shared:
+                names |= self._members[key]
+        names.discard(filename)
+        return sorted(names)
+
+    def groups(self):
+        """
+        Returns sorted lists of filenames that duplicate each other, by invoice
+        number or content (transitively), each group sorted by filename.
+        """
+        parent = {}
+
+        def find(name):
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        for key in self._shared:
+            names = sorted(self._members[key])
+            for name in names:
+                parent.setdefault(name, name)
+            root = find(names[0])
+            for name in names[1:]:
+                other = find(name)
+                if other != root:
+                    parent[max(root, other)] = min(root, other)
+                    root = min(root, other)
+
+        components = {}
+        for name in parent:
+            components.setdefault(find(name), []).append(name)
+        return sorted(sorted(names) for names in components.values())
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from collections import deque
+
+# Events kept for clients reconnecting with Last-Event-ID; older ones get a "resync"
+EVENT_BACKLOG = int(os.environ.get("LAZYFP_EVENT_BACKLOG", 2000))
+# Seconds between keep-alive comments on an idle stream (proxies drop silent connections)
+KEEPALIVE = float(os.environ.get("LAZYFP_EVENT_KEEPALIVE", 15))
+# Reconnect delay suggested to EventSource clients (milliseconds)
+RETRY_MS = 2000
+
+
+class ChangeFeed:
+    """
+    Ordered feed of change events ("kind" + JSON-ready data) served as
+    server-sent events. Publishers are plain threads; readers are asyncio
+    streams. Events live in one shared ring of EVENT_BACKLOG entries rather
+    than per-client queues: a client reads from its own cursor, so a slow or
+    reconnecting client costs nothing until it falls off the ring, and then
+    gets a single "resync" event telling it to reload the list.
+    Event ids are "<epoch>:<seq>"; the epoch changes with the process, so ids
+    from before a restart are never mistaken for current ones.
+    """
+
+    def __init__(self, backlog=EVENT_BACKLOG):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=backlog)  # (seq, kind, JSON text)
+        self._seq = 0
+        self._last = {}  # kind -> monotonic time of its last publish
+        self._waiters = set()  # (event loop, asyncio.Event) of connected streams
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def subscribers(self):
+        return len(self._waiters)
+
+    def publish(self, kind, data, every=None):
+        """
+        Appends an event and wakes the connected streams. With `every`, the
+        event is dropped if one of the same kind went out less than `every`
+        seconds ago (progress reports; the final report is published without).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if every is not None and now - self._last.get(kind, float("-inf")) < every:
+                return
+            self._last[kind] = now
+            self._seq += 1
+            self._events.append((self._seq, kind, json.dumps(data, ensure_ascii=False)))
+            waiters = list(self._waiters)
+        for loop, wake in waiters:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # Loop already closed; its stream is gone
+
+    def close(self):
+        """
+        Ends every open stream (server shutdown).
+        """
+        with self._lock:
+            self._closed = True
+            waiters = list(self._waiters)
+        for loop, wake in waiters:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass
+
+    def _cursor(self, last_event_id):
+        """
+        Sequence number a stream resumes after, or None when last_event_id is
+        from another process or older than the backlog. Caller holds the lock.
+        """
+        epoch, _, seq = (last_event_id or "").partition(":")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._events[0][0] if self._events else self._seq + 1
+        return seq if oldest - 1 <= seq <= self._seq else None
+
+    def _after(self, cursor):
+        """
+        Events after cursor, or None when some of them already left the ring.
+        """
+        with self._lock:
+            if self._events and self._events[0][0] > cursor + 1:
+                return None
+            return [e for e in self._events if e[0] > cursor]
+
+    def _format(self, seq, kind, payload):
+        return f"id: {self.epoch}:{seq}\nevent: {kind}\ndata: {payload}\n\n"
+
+    async def stream(self, last_event_id=None):
+        """
+        Yields text/event-stream chunks: the events after last_event_id (a
+        fresh connection starts from now), then new ones as they come, with a
+        keep-alive comment every KEEPALIVE idle seconds. A stream whose
+        position is unknown or lost starts with a "resync" event.
+        """
+        wake = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wake)
+        with self._lock:
+            self._waiters.add(waiter)
+            cursor = self._seq if last_event_id is None else self._cursor(last_event_id)
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while not self._closed:
+                wake.clear()
+                batch = self._after(cursor) if cursor is not None else None
+                if batch is None:
+                    with self._lock:
+                        cursor = self._seq
+                    yield self._format(cursor, "resync", "{}")
+                    continue
+                if batch:
+                    cursor = batch[-1][0]
+                    yield "".join(self._format(*e) for e in batch)
+                    continue
+                try:
+                    await asyncio.wait_for(wake.wait(), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import random
+import shutil
+import zipfile
+import argparse
+import logging
+from xml.sax.saxutils import escape
+
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+# Built-in CJK font: no font files needed, works offline
+FONT = "STSong-Light"
+
+PURCHASERS = [
+    "上海某某科技有限公司", "杭州某某网络科技有限公司", "广州甲乙贸易有限公司",
+    "成都某某咨询有限公司", "南京某某物流有限公司", "武汉某某食品有限公司",
+]
+SELLERS = [
+    "北京某某服务有限公司", "深圳丙丁电子有限公司", "重庆某某咨询有限公司",
+    "苏州某某机械有限公司", "长沙某某餐饮管理有限公司", "天津某某股份有限公司",
+]
+CARRIERS = ["中国移动通信集团浙江有限公司", "中国联合网络通信有限公司上海市分公司"]
+
+# Relative frequency of each layout in a generated corpus
+LAYOUTS = {
+    "digital": 60,     # 20-digit fully digital invoice (全电发票)
+    "monitor": 15,     # Older VAT invoice: 8-digit number, 发票代码, 监 line
+    "statement": 10,   # Carrier 对账单 (customer account instead of invoice number)
+    "spaced": 10,      # Labels and digits spaced out by the PDF producer
+    "textless": 5,     # Scanned/image-only: no extractable text
+    "merged": 4,       # Several digital invoices merged into one PDF, one per page
+    "statement_long": 4,  # Multi-page 对账单: the carrier (seller) only appears on the last page
+    "xml": 3,          # Fully digital invoice issued as structured XML
+    "ofd": 3,          # OFD invoice: number/date/amount in metadata, names only in the page text
+}
+
+
+def _amount(rng):
+    return round(rng.uniform(1, 20000), 2)
+
+
+def _date(rng):
+    return rng.randint(2019, 2025), rng.randint(1, 12), rng.randint(1, 28)
+
+
+def layout_digital(rng, i):
+    no = f"{rng.randint(10, 99)}{rng.randint(0, 10**18 - 1):018d}"
+    y, m, d = _date(rng)
+    p, s, amt = rng.choice(PURCHASERS), rng.choice(SELLERS), _amount(rng)
+    lines = [
+        (350, 370, f"发票号码：{no}"),
+        (350, 355, f"开票日期：{y}年{m:02d}月{d:02d}日"),
+        (20, 300, f"购 名称：{p}"),
+        (320, 300, f"销 名称：{s}"),
+        (20, 100, f"价税合计（大写） 略 （小写）¥{amt:.2f}"),
+    ]
+    return lines, {"invoice_no": no, "date": f"{y}年{m:02d}月{d:02d}日", "purchaser": p, "seller": s, "total_amount": amt}
+
+
+def layout_monitor(rng, i):
+    no = f"{rng.randint(0, 10**8 - 1):08d}"
+    y, m, d = _date(rng)
+    p, s, amt = rng.choice(PURCHASERS), rng.choice(SELLERS), _amount(rng)
+    lines = [
+        (350, 380, f"发票代码：0440019{rng.randint(0, 99999):05d}"),
+        (350, 370, f"发 票 号 码： {no}"),
+        (350, 355, f"开 票 日 期： {y}年{m:02d}月{d:02d}日"),
+        (20, 300, f"名 称： {p}"),
+        (20, 200, f"名 称： {s}"),
+        (300, 120, f"（小写）¥ {amt:,.2f}"),
+        (500, 390, f"监 {rng.randint(0, 10**8 - 1):08d}"),
+    ]
+    return lines, {"invoice_no": no, "date": f"{y}年{m:02d}月{d:02d}日", "purchaser": p, "seller": s, "total_amount": amt}
+
+
+def layout_statement(rng, i):
+    account = f"{rng.randint(10**9, 10**10 - 1)}"
+    y, m = rng.randint(2019, 2025), rng.randint(1, 12)
+    p, carrier = rng.choice(PURCHASERS), rng.choice(CARRIERS)
+    lines = [
+        (20, 380, "中国移动 对账单"),
+        (20, 360, f"客户账号：{account}"),
+        (20, 345, f"集团编号：{rng.randint(10**10, 10**11 - 1)}"),
+        (20, 330, f"账期：{y}{m:02d}01"),
+        (20, 300, f"客户名称：{p}"),
+        (20, 150, f"合计 ¥ {_amount(rng):.2f}"),
+        (20, 120, carrier),
+    ]
+    return lines, {"invoice_no": account, "date": f"{y}年{m:02d}月01日", "purchaser": p, "seller": carrier}
+
+
+def layout_spaced(rng, i):
+    y, m, d = _date(rng)
+    p, s, amt = rng.choice(PURCHASERS), rng.choice(SELLERS), _amount(rng)
+    date = " ".join(f"{y}{m:02d}{d:02d}")
+    lines = [
+        (350, 355, f"开 票 日 期 {date}"),
+        (20, 300, f"购买方 名 称 {p}"),
+        (20, 200, f"销售方 名 称 {s}"),
+        (20, 100, f"价 税 合 计 （ 大 写 ） 略 ¥{amt:.2f}"),
+    ]
+    return lines, {"date": f"{y}年{m:02d}月{d:02d}日", "purchaser": p, "seller": s, "total_amount": amt}
+
+
+def layout_textless(rng, i):
+    # Vector shapes only, like a scan without an OCR layer
+    return [], {}
+
+
+# Multi-page layouts return a list of pages (each a list of lines)
+
+def layout_merged(rng, i):
+    pages, invoices = [], []
+    for _ in range(rng.randint(2, 6)):
+        lines, expected = layout_digital(rng, i)
+        pages.append(lines)
+        invoices.append(expected)
+    return pages, dict(invoices[0], invoices=invoices)
+
+
+def layout_statement_long(rng, i):
+    lines, expected = layout_statement(rng, i)
+    carrier = lines[-1]
+    details = [(20, 380 - 15 * k, f"{k + 1:02d} 通信费 ¥ {_amount(rng):.2f}") for k in range(rng.randint(5, 20))]
+    return [lines[:-1], details, [(20, 380, f"本期合计 ¥ {_amount(rng):.2f}"), carrier]], expected
+
+
+def layout_xml(rng, i):
+    return layout_digital(rng, i)
+
+
+def layout_ofd(rng, i):
+    return layout_digital(rng, i)
+
+
+GENERATORS = {
+    "digital": layout_digital,
+    "monitor": layout_monitor,
+    "statement": layout_statement,
+    "spaced": layout_spaced,
+    "textless": layout_textless,
+    "merged": layout_merged,
+    "statement_long": layout_statement_long,
+    "xml": layout_xml,
+    "ofd": layout_ofd,
+}
+
+
+def write_pdf(path, lines, rng, size=(600, 400)):
+    """
+    lines: one page of (x, y, text), or a list of such pages.
+    """
+    pages = lines if lines and isinstance(lines[0], list) else [lines]
+    c = canvas.Canvas(path, pagesize=size)
+    for page in pages:
+        c.setFont(FONT, 10)
+        for x, y, text in page:
+            c.drawString(x, y, text)
+        if not page:
+            for _ in range(20):
+                c.rect(rng.uniform(0, 550), rng.uniform(0, 350), rng.uniform(5, 50), rng.uniform(2, 20))
+        c.showPage()
+    c.save()
+
+
+def write_xml(path, lines, expected):
+    """
+    Fully digital invoice XML (数电票 schema subset).
+    """
+    e = {k: escape(str(v)) for k, v in expected.items()}
+    date = expected["date"].replace("年", "-").replace("月", "-").replace("日", "")
+    amount = round(expected["total_amount"] / 1.06, 2)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n<EInvoice><Header><EIid>{invoice_no}</EIid></Header><EInvoiceData>'
+            '<SellerInformation><SellerName>{seller}</SellerName></SellerInformation>'
+            '<BuyerInformation><BuyerName>{purchaser}</BuyerName></BuyerInformation>'
+            '<BasicInformation><TotalAmWithoutTax>{amount:.2f}</TotalAmWithoutTax>'
+            '<TotalTax-includedAmount>{total_amount:.2f}</TotalTax-includedAmount><RequestTime>{date} 10:00:00</RequestTime>'
+            '</BasicInformation></EInvoiceData><TaxSupervisionInfo><InvoiceNumber>{invoice_no}</InvoiceNumber>'
+            '<IssueTime>{date} 10:00:00</IssueTime></TaxSupervisionInfo></EInvoice>\n'.format(
+                invoice_no=e["invoice_no"], seller=e["seller"], purchaser=e["purchaser"],
+                amount=amount, total_amount=expected["total_amount"], date=date)
+        )
+
+
+def write_ofd(path, lines, expected):
+    """
+    OFD package: invoice metadata (CustomData) in OFD.xml, the text lines on one page.
+    """
+    ns = 'xmlns:ofd="http://www.ofdspec.org/2016"'
+    amount = round(expected["total_amount"] / 1.06, 2)
+    custom = {
+        "发票号码": expected["invoice_no"],
+        "开票日期": expected["date"],
+        "合计金额": f"{amount:.2f}",
+        "合计税额": f"{expected['total_amount'] - amount:.2f}",
+    }
+    meta = "".join(f'<ofd:CustomData Name="{k}">{escape(v)}</ofd:CustomData>' for k, v in custom.items())
+    objects = "".join(
+        f'<ofd:TextObject ID="{n}" Boundary="0 0 600 400" Font="1" Size="3.5">'
+        f'<ofd:TextCode X="{x / 4:.1f}" Y="{(400 - y) / 4:.1f}">{escape(text)}</ofd:TextCode></ofd:TextObject>'
+        for n, (x, y, text) in enumerate(lines, 10)
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("OFD.xml", f'<?xml version="1.0" encoding="UTF-8"?><ofd:OFD {ns} Version="1.1" DocType="OFD">'
+                               f'<ofd:DocBody><ofd:DocInfo><ofd:CustomDatas>{meta}</ofd:CustomDatas></ofd:DocInfo>'
+                               f'<ofd:DocRoot>Doc_0/Document.xml</ofd:DocRoot></ofd:DocBody></ofd:OFD>')
+        zf.writestr("Doc_0/Document.xml", f'<?xml version="1.0" encoding="UTF-8"?><ofd:Document {ns}><ofd:Pages>'
+                                          f'<ofd:Page ID="1" BaseLoc="Pages/Page_0/Content.xml"/></ofd:Pages></ofd:Document>')
+        zf.writestr("Doc_0/Pages/Page_0/Content.xml", f'<?xml version="1.0" encoding="UTF-8"?><ofd:Page {ns}><ofd:Content>'
+                                                      f'<ofd:Layer ID="2">{objects}</ofd:Layer></ofd:Content></ofd:Page>')
+
+
+# Layouts written as something other than a PDF: extension, writer(path, lines, expected)
+WRITERS = {
+    "xml": (".xml", write_xml),
+    "ofd": (".ofd", write_ofd),
+}
+
+
+def generate(out_dir, count, seed=0, duplicates=0.05, layouts=None):
+    """
+    Writes `count` synthetic invoices to out_dir plus manifest.json
+    ({filename: {"layout": ..., "expected": {...}}}; merged PDFs also list
+    every page's fields under expected["invoices"]). A `duplicates` fraction
+    of files are byte-identical copies of earlier ones. Same seed, same corpus.
+    """
+    pdfmetrics.registerFont(UnicodeCIDFont(FONT))
+    rng = random.Random(seed)
+    weights = layouts or LAYOUTS
+    names, cum = list(weights), list(weights.values())
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest = {}
+    written = []
+    for i in range(count):
+        if written and rng.random() < duplicates:
+            original = rng.choice(written)
+            filename = f"{i:06d}_copy{os.path.splitext(original)[1]}"
+            shutil.copyfile(os.path.join(out_dir, original), os.path.join(out_dir, filename))
+            manifest[filename] = dict(manifest[original], copy_of=original)
+            continue
+        layout = rng.choices(names, weights=cum)[0]
+        lines, expected = GENERATORS[layout](rng, i)
+        ext, writer = WRITERS.get(layout, (".pdf", None))
+        filename = f"{i:06d}_{layout}{ext}"
+        if writer:
+            writer(os.path.join(out_dir, filename), lines, expected)
+        else:
+            write_pdf(os.path.join(out_dir, filename), lines, rng)
+        manifest[filename] = {"layout": layout, "expected": expected}
+        written.append(filename)
+
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    logging.info(f"Wrote {count} synthetic invoices to '{out_dir}'")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic invoice corpus (PDF, plus XML and OFD invoices).")
+    parser.add_argument("out_dir")
+    parser.add_argument("-n", "--count", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicates", type=float, default=0.05, help="fraction of byte-identical copies")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    generate(args.out_dir, args.count, args.seed, args.duplicates)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
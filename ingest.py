@@ -0,0 +1,76 @@
+import queue
+import logging
+import threading
+
+
+class IngestQueue:
+    """
+    Background worker that extracts freshly written files as they arrive.
+    submit(filename, digest) queues a file; the worker drains everything
+    queued so far and hands it to handler({filename: digest}) as one batch,
+    so a multi-file upload is parsed together (in parallel by the pool).
+    """
+
+    def __init__(self, handler, name="ingest"):
+        self.handler = handler
+        self.name = name
+        self._queue = queue.Queue()
+        self._pending = {}  # filename -> submissions not handled yet
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+
+    def submit(self, filename, digest=None):
+        with self._lock:
+            self._pending[filename] = self._pending.get(filename, 0) + 1
+        self._queue.put((filename, digest))
+        self.start()
+
+    def is_pending(self, filename):
+        with self._lock:
+            return filename in self._pending
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            stop = False
+            # Take whatever else is already waiting: one handler call per burst
+            while True:
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                digests = {}
+                for filename, digest in batch:
+                    digests[filename] = digest
+                try:
+                    self.handler(digests)
+                except Exception as e:
+                    logging.error(f"Ingest of {len(digests)} files failed: {e}")
+                finally:
+                    with self._lock:
+                        for filename, _ in batch:
+                            self._pending[filename] -= 1
+                            if not self._pending[filename]:
+                                del self._pending[filename]
+            if stop:
+                return
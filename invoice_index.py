@@ -0,0 +1,396 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from metrics import INDEX_SECONDS
+
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    path   TEXT PRIMARY KEY,
+    dir    TEXT NOT NULL,
+    mtime  REAL NOT NULL,
+    size   INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+CREATE INDEX IF NOT EXISTS files_digest ON files(digest);
+CREATE TABLE IF NOT EXISTS records (
+    digest       TEXT NOT NULL,
+    page         INTEGER NOT NULL DEFAULT 1,
+    invoice_no   TEXT,
+    date         TEXT,
+    purchaser    TEXT,
+    seller       TEXT,
+    total_amount REAL,
+    quarter      TEXT,
+    data         TEXT NOT NULL,
+    extractor    INTEGER,
+    PRIMARY KEY (digest, page)
+);
+CREATE INDEX IF NOT EXISTS records_invoice_no ON records(invoice_no);
+CREATE INDEX IF NOT EXISTS records_purchaser_quarter ON records(purchaser, quarter);
+CREATE INDEX IF NOT EXISTS records_quarter ON records(quarter);
+CREATE TABLE IF NOT EXISTS texts (
+    digest TEXT PRIMARY KEY,
+    layer  BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quarantine (
+    digest TEXT PRIMARY KEY,
+    path   TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    at     REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS organized (
+    target TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    method TEXT NOT NULL
+);
+"""
+
+# v2 -> v3: records are keyed by (digest, page), one row per invoice of a multi-invoice PDF
+_MIGRATE_V3 = """
+BEGIN;
+DROP INDEX IF EXISTS records_invoice_no;
+DROP INDEX IF EXISTS records_purchaser_quarter;
+DROP INDEX IF EXISTS records_quarter;
+ALTER TABLE records RENAME TO records_v2;
+{schema}
+INSERT INTO records(digest, invoice_no, date, purchaser, seller, total_amount, quarter, data, extractor)
+    SELECT digest, invoice_no, date, purchaser, seller, total_amount, quarter, data, extractor FROM records_v2;
+DROP TABLE records_v2;
+COMMIT;
+"""
+
+# SQLite caps bound parameters per statement; stay well below it
+_CHUNK = 500
+
+
+def _subtree_range(root):
+    """
+    Bounds (exclusive) of the paths below root, so a subtree is a range scan on the primary key.
+    """
+    prefix = os.path.join(os.path.normpath(root), "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class InvoiceIndex:
+    """
+    Transactional on-disk invoice index (SQLite, WAL mode).
+
+    `files` holds per-path metadata (mtime, size, content digest),
+    `records` holds extracted fields per content digest and page (page 1
+    unless the PDF holds several invoices), with the version of the
+    extractor that produced them; `texts` holds the page text layer each
+    file's records were extracted from; `quarantine` holds content that
+    extraction gave up on (timeout, memory cap, crash) and why. Each thread
+    gets its own connection; writers are serialized by SQLite itself.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            # v1 -> v2: records gain the extractor version (NULL: unknown, re-extracted on next scan)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(records)")}
+            if "extractor" not in columns:
+                conn.execute("ALTER TABLE records ADD COLUMN extractor INTEGER")
+            if "page" not in columns:
+                conn.executescript(_MIGRATE_V3.format(schema=SCHEMA))
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Meta ---
+
+    def get_meta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, str(value)))
+
+    # --- Files ---
+
+    def files_under(self, root):
+        """
+        Returns {path: (mtime, size, digest)} for files indexed anywhere below root.
+        """
+        low, high = _subtree_range(root)
+        with INDEX_SECONDS.time("load"):
+            rows = self._conn().execute(
+                "SELECT path, mtime, size, digest FROM files WHERE path > ? AND path < ?", (low, high)
+            )
+            return {path: (mtime, size, digest) for path, mtime, size, digest in rows}
+
+    def get_files(self, paths):
+        """
+        Returns {path: (mtime, size, digest)} for the given indexed paths.
+        """
+        paths = list(paths)
+        found = {}
+        conn = self._conn()
+        with INDEX_SECONDS.time("load"):
+            for i in range(0, len(paths), _CHUNK):
+                chunk = paths[i:i + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                for path, mtime, size, digest in conn.execute(
+                    f"SELECT path, mtime, size, digest FROM files WHERE path IN ({marks})", chunk
+                ):
+                    found[path] = (mtime, size, digest)
+        return found
+
+    # --- Records ---
+
+    def get_records(self, digests):
+        """
+        Returns {digest: [record per invoice, in page order]} for the digests present in the index.
+        """
+        digests = list(digests)
+        found = {}
+        conn = self._conn()
+        with INDEX_SECONDS.time("load"):
+            for i in range(0, len(digests), _CHUNK):
+                chunk = digests[i:i + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                for digest, data in conn.execute(
+                    f"SELECT digest, data FROM records WHERE digest IN ({marks}) ORDER BY digest, page", chunk
+                ):
+                    found.setdefault(digest, []).append(json.loads(data))
+        return found
+
+    def outdated_records(self, digests, extractor):
+        """
+        Returns the subset of digests whose record was produced by another extractor version.
+        """
+        digests = list(digests)
+        found = set()
+        conn = self._conn()
+        with INDEX_SECONDS.time("load"):
+            for i in range(0, len(digests), _CHUNK):
+                chunk = digests[i:i + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                for (digest,) in conn.execute(
+                    f"SELECT DISTINCT digest FROM records WHERE digest IN ({marks}) AND extractor IS NOT ?", chunk + [extractor]
+                ):
+                    found.add(digest)
+        return found
+
+    # --- Text layers ---
+
+    def get_texts(self, digests):
+        """
+        Returns {digest: text layer blob} for the digests with a stored text layer.
+        """
+        digests = list(digests)
+        found = {}
+        conn = self._conn()
+        with INDEX_SECONDS.time("load"):
+            for i in range(0, len(digests), _CHUNK):
+                chunk = digests[i:i + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                for digest, layer in conn.execute(f"SELECT digest, layer FROM texts WHERE digest IN ({marks})", chunk):
+                    found[digest] = layer
+        return found
+
+    # --- Quarantine ---
+
+    def quarantined(self, digests):
+        """
+        Returns the subset of digests held in quarantine.
+        """
+        digests = list(digests)
+        found = set()
+        conn = self._conn()
+        for i in range(0, len(digests), _CHUNK):
+            chunk = digests[i:i + _CHUNK]
+            marks = ",".join("?" * len(chunk))
+            found.update(d for (d,) in conn.execute(f"SELECT digest FROM quarantine WHERE digest IN ({marks})", chunk))
+        return found
+
+    def quarantine_entries(self):
+        """
+        Returns [(path, digest, reason, time quarantined)], most recent first.
+        """
+        rows = self._conn().execute("SELECT path, digest, reason, at FROM quarantine ORDER BY at DESC")
+        return list(rows)
+
+    def release_quarantine(self, digests=None):
+        """
+        Lets the next scan retry quarantined content (all of it when digests is None).
+        Returns the number of entries released.
+        """
+        with self._conn() as conn:
+            if digests is None:
+                return conn.execute("DELETE FROM quarantine").rowcount
+            return conn.executemany("DELETE FROM quarantine WHERE digest = ?", [(d,) for d in digests]).rowcount
+
+    def query(self, purchaser=None, quarter=None, invoice_no=None, directory=None, roots=None):
+        """
+        Returns [(path, record)] for indexed invoices matching the given fields
+        (one per invoice: a multi-invoice PDF may appear more than once).
+        None skips a filter; "" matches a missing value. directory matches
+        files directly in it; roots matches files anywhere below any of them.
+        """
+        clauses, params = [], []
+        if roots is not None:
+            ranges = [_subtree_range(root) for root in roots]
+            clauses.append("(" + " OR ".join("(f.path > ? AND f.path < ?)" for _ in ranges) + ")")
+            params += [bound for r in ranges for bound in r]
+        for column, value in (("r.purchaser", purchaser), ("r.quarter", quarter),
+                              ("r.invoice_no", invoice_no), ("f.dir", directory)):
+            if value == "":
+                clauses.append(f"({column} IS NULL OR {column} = '')")
+            elif value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(os.path.normpath(value) if column == "f.dir" else value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT f.path, r.data FROM files f JOIN records r ON r.digest = f.digest {where} ORDER BY f.path, r.page",
+            params,
+        )
+        return [(path, json.loads(data)) for path, data in rows]
+
+    # --- Organized manifest ---
+
+    def organized_entries(self):
+        """
+        Returns {target: (source, digest, method)} for every organized copy placed so far.
+        """
+        rows = self._conn().execute("SELECT target, source, digest, method FROM organized")
+        return {target: (source, digest, method) for target, source, digest, method in rows}
+
+    def apply_organized(self, placed=(), removed=()):
+        """
+        Updates the organized manifest in one transaction.
+        placed:  iterable of (target, source, digest, method)
+        removed: iterable of targets
+        """
+        with self._conn() as conn:
+            conn.executemany("INSERT OR REPLACE INTO organized(target, source, digest, method) VALUES (?, ?, ?, ?)",
+                             list(placed))
+            conn.executemany("DELETE FROM organized WHERE target = ?", [(t,) for t in removed])
+
+    # --- Writes ---
+
+    def apply(self, files=(), records=(), deleted=(), texts=(), restamped=(), quarantined=(), released=(),
+              extractor=None):
+        """
+        Applies one batch of changes in a single transaction.
+        files:     iterable of (path, mtime, size, digest)
+        records:   iterable of (digest, record, quarter), stamped with `extractor`; they replace
+                   every record held for their digest (record["page"] tells invoices of one PDF apart)
+        deleted:   iterable of paths
+        texts:     iterable of (digest, text layer blob)
+        restamped: iterable of digests whose record `extractor` left unchanged (only the stamp is updated)
+        quarantined: iterable of (digest, path, reason) extraction gave up on
+        released:  iterable of digests taken out of quarantine (before `quarantined` is added)
+        Records, text layers and quarantine entries no longer referenced by any file are pruned.
+        """
+        records = list(records)
+        with INDEX_SECONDS.time("save"), self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO files(path, dir, mtime, size, digest) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime, size = excluded.size, digest = excluded.digest",
+                [(p, os.path.dirname(p), m, s, d) for p, m, s, d in files],
+            )
+            conn.executemany("DELETE FROM records WHERE digest = ?", [(d,) for d in {d for d, _, _ in records}])
+            conn.executemany(
+                "INSERT OR REPLACE INTO records(digest, page, invoice_no, date, purchaser, seller, total_amount, quarter, "
+                "data, extractor) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (d, r.get("page", 1), r.get("invoice_no"), r.get("date"), r.get("purchaser"), r.get("seller"),
+                     r.get("total_amount"), q, json.dumps(r, ensure_ascii=False), extractor)
+                    for d, r, q in records
+                ],
+            )
+            conn.executemany("UPDATE records SET extractor = ? WHERE digest = ?", [(extractor, d) for d in restamped])
+            conn.executemany("INSERT OR REPLACE INTO texts(digest, layer) VALUES (?, ?)", list(texts))
+            conn.executemany("DELETE FROM quarantine WHERE digest = ?", [(d,) for d in released])
+            now = time.time()
+            conn.executemany("INSERT OR REPLACE INTO quarantine(digest, path, reason, at) VALUES (?, ?, ?, ?)",
+                             [(d, p, reason, now) for d, p, reason in quarantined])
+            conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in deleted])
+            if files or deleted:
+                conn.execute("DELETE FROM records WHERE digest NOT IN (SELECT digest FROM files)")
+                conn.execute("DELETE FROM texts WHERE digest NOT IN (SELECT digest FROM files)")
+                conn.execute("DELETE FROM quarantine WHERE digest NOT IN (SELECT digest FROM files)")
+
+    # --- Migration ---
+
+    def migrate_json_cache(self, cache_file, input_dir, digest_fn, quarter_fn):
+        """
+        Imports a JSON cache (content-hash or legacy filename-keyed) once,
+        then renames it to `<cache_file>.migrated`.
+        """
+        if self.get_meta("json_migrated") or not os.path.exists(cache_file):
+            return 0
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except Exception as e:
+            logging.error(f"Failed to load cache for migration: {e}")
+            return 0
+
+        files, records = [], {}
+        if "files" in raw and "records" in raw:
+            for path, e in raw["files"].items():
+                if e.get("digest") in raw["records"]:
+                    files.append((os.path.normpath(path), e["mtime"], e["size"], e["digest"]))
+                    records[e["digest"]] = raw["records"][e["digest"]]
+        else:
+            # Legacy: {filename: {mtime, size, data}} for files in input_dir
+            for filename, e in raw.items():
+                path = os.path.normpath(os.path.join(input_dir, filename))
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if not e.get("data") or e.get("mtime") != st.st_mtime or e.get("size") != st.st_size:
+                    continue
+                digest = digest_fn(path)
+                record = dict(e["data"])
+                record.pop("filename", None)
+                files.append((path, st.st_mtime, st.st_size, digest))
+                records[digest] = record
+
+        self.apply(files=files, records=[(d, r, quarter_fn(r.get("date"))) for d, r in records.items()])
+        self.set_meta("json_migrated", 1)
+        try:
+            os.replace(cache_file, cache_file + ".migrated")
+        except OSError as e:
+            logging.error(f"Failed to rename migrated cache: {e}")
+        logging.info(f"Migrated {len(files)} cache entries from {cache_file} to {self.db_path}")
+        return len(files)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def open_index(db_path):
+    """
+    Returns the shared InvoiceIndex for db_path (one per process).
+    """
+    with _indexes_lock:
+        index = _indexes.get(db_path)
+        if index is None:
+            index = _indexes[db_path] = InvoiceIndex(db_path)
+        return index
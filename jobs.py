@@ -0,0 +1,160 @@
+import time
+import uuid
+import logging
+import threading
+
+from main import scan_directory
+
+# Finished jobs kept around so clients can still read their final state
+MAX_FINISHED_JOBS = 20
+
+
+class ScanJob:
+    """
+    A scan_directory run on a background thread, with progress and cancellation.
+    """
+
+    def __init__(self, input_dir, listeners=()):
+        self.id = uuid.uuid4().hex[:12]
+        self.input_dir = input_dir
+        self.listeners = list(listeners)
+        self.status = "pending"  # pending -> running -> done | cancelled | failed
+        self.error = None
+        self.done = 0
+        self.total = None
+        self.parsed = 0
+        self.started_at = None
+        self.finished_at = None
+        self.records = []
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"scan-{self.id}", daemon=True).start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def _on_progress(self, record, done, total, cached):
+        with self._lock:
+            if record is not None:
+                self.records.append(record)
+            if not cached and (record is None or record.get("page", 1) == 1):
+                self.parsed += 1
+            self.done = done
+            self.total = total
+        # A failing listener must not abort the scan it is watching
+        for listener in self.listeners:
+            try:
+                listener.scan_record(self, record)
+            except Exception:
+                logging.exception(f"Scan job listener failed on a record of job {self.id}")
+
+    def _run(self):
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            data_list = scan_directory(self.input_dir, progress=self._on_progress, cancel=self._cancel)
+            with self._lock:
+                self.records = data_list
+            self.status = "cancelled" if self._cancel.is_set() else "done"
+        except Exception as e:
+            logging.error(f"Scan job {self.id} failed: {e}")
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = time.time()
+            self._finished.set()
+            for listener in self.listeners:
+                try:
+                    listener.scan_finished(self)
+                except Exception:
+                    logging.exception(f"Scan job listener failed at the end of job {self.id}")
+
+    def snapshot_records(self):
+        with self._lock:
+            return list(self.records)
+
+    def progress(self):
+        """
+        Returns a JSON-ready progress report (files done/remaining, rate, ETA).
+        """
+        with self._lock:
+            done, total, parsed = self.done, self.total, self.parsed
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        remaining = max((total or 0) - done, 0)
+        rate = parsed / elapsed if elapsed > 0 else 0.0
+        eta = remaining / rate if rate > 0 and not self.finished else None
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "done": done,
+            "total": total,
+            "remaining": remaining,
+            "rate": round(rate, 2),
+            "eta": round(eta, 1) if eta is not None else None,
+            "elapsed": round(elapsed, 2),
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Tracks scan jobs. At most one scan per directory runs at a time;
+    starting another joins the running one. Subscribed listeners get
+    scan_record(job, record) per resolved file and scan_finished(job).
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def start(self, input_dir):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.input_dir == input_dir and not job.finished:
+                    return job
+            job = ScanJob(input_dir, self._listeners)
+            self._jobs[job.id] = job
+            self._prune()
+        job.start()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def running(self, input_dir):
+        """
+        Returns the unfinished job scanning input_dir, if any.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.input_dir == input_dir and not job.finished:
+                    return job
+        return None
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        finished.sort(key=lambda j: j.finished_at)
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job.id]
+
+
+scan_jobs = JobManager()
@@ -0,0 +1,381 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from functools import partial
+
+from main import update_files, get_quarter, scan_roots, is_excluded, SCAN_RECURSIVE, INVOICE_EXTENSIONS
+from watcher import make_watcher
+from ingest import IngestQueue
+from duplicates import DuplicateIndex
+from events import ChangeFeed
+
+# Watcher backend: "auto" (inotify, else polling), "inotify", "poll" or "off"
+WATCH_MODE = os.environ.get("LAZYFP_WATCH", "auto")
+POLL_INTERVAL = float(os.environ.get("LAZYFP_POLL_INTERVAL", 2.0))
+# Seconds between scan progress events
+PROGRESS_INTERVAL = 0.5
+
+AGG_FIELDS = ["date", "purchaser", "seller", "total_amount"]
+SORT_KEYS = ["invoice_no", "date", "purchaser", "seller", "total_amount", "quarter", "count", "filename"]
+SEARCH_FIELDS = ["invoice_no", "purchaser", "seller", "filename", "total_amount"]
+
+# Serialized query results kept per index version
+MAX_CACHED_QUERIES = 32
+
+
+def _blank(value):
+    return "" if value is None else value
+
+
+def row_key(key):
+    """
+    Stable id of a grouped row: "no:<invoice number>" or "file:<filename>".
+    """
+    return f"{key[0]}:{key[1]}"
+
+
+def _filter_rows(rows, purchaser=None, quarter=None, seller=None, min_amount=None, max_amount=None,
+                 search=None, sort=None):
+    """
+    The rows matching every given filter, sorted by sort (see LiveIndex.select).
+    """
+    for field, value in (("purchaser", purchaser), ("quarter", quarter), ("seller", seller)):
+        if value is not None:
+            rows = [r for r in rows if r[field] == value]
+    if min_amount is not None or max_amount is not None:
+        lo = float("-inf") if min_amount is None else min_amount
+        hi = float("inf") if max_amount is None else max_amount
+        rows = [r for r in rows if r["total_amount"] != "" and lo <= r["total_amount"] <= hi]
+    if search:
+        needle = search.lower()
+        rows = [r for r in rows if any(needle in str(r[f]).lower() for f in SEARCH_FIELDS if r[f] != "")]
+    if sort:
+        field = sort.lstrip("-")
+        if field not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {field}")
+        if field in ("total_amount", "count"):
+            key = lambda r: r[field] if r[field] != "" else 0
+        else:
+            key = lambda r: str(r[field]).lower()
+        # Python's sort is stable: ties keep the default order
+        rows.sort(key=key, reverse=sort.startswith("-"))
+    return rows
+
+
+class LiveIndex:
+    """
+    In-memory view of input_dir kept current by a filesystem watcher and by
+    scan jobs. Holds raw records per filename plus the grouped rows served by
+    GET /api/invoices (same shape as process_invoices, plus a stable row
+    "key"), updated one group at a time; the serialized snapshot is rebuilt
+    only after a change. Every change is published on `events` (a
+    ChangeFeed): "change" carries the files added/updated/removed and the
+    delta of the groups they touched, "duplicates" the changed files that
+    now have duplicates, "scan" the progress of scan jobs.
+    """
+
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self.version = 0
+        self.watchers = []  # one per scan root
+        self._lock = threading.RLock()
+        self._records = {}  # filename -> raw record
+        self._groups = {}  # group key -> set of filenames
+        self._rows = {}  # group key -> aggregated row
+        self.duplicates = DuplicateIndex()
+        self.events = ChangeFeed()
+        self._touched = {}  # filename -> time of last watcher update
+        self._snapshot = (-1, 0, b"[]")  # (version, row count, JSON bytes)
+        self._queries = {}  # (version, params) -> (total, JSON bytes)
+        self.ingest_queue = IngestQueue(self._ingest, name=f"ingest-{input_dir}")
+
+    # --- Lifecycle ---
+
+    def start(self, mode=None, interval=None):
+        """
+        Starts a filesystem watcher per scan root (missing roots are skipped).
+        Returns False when watching is off.
+        """
+        mode = WATCH_MODE if mode is None else mode
+        interval = POLL_INTERVAL if interval is None else interval
+        self.ingest_queue.start()
+        for prefix, root in scan_roots(self.input_dir):
+            if not os.path.isdir(root):
+                # Not there (yet), e.g. an unmounted extra root: scans skip it the same way
+                logging.warning(f"Not watching '{root}': no such directory")
+                continue
+            watcher = make_watcher(root, partial(self._on_fs_change, prefix), mode, interval,
+                                   recursive=SCAN_RECURSIVE, skip_dir=is_excluded)
+            if watcher is None:
+                return False
+            watcher.start()
+            self.watchers.append(watcher)
+            logging.info(f"Watching '{root}' with {type(watcher).__name__}")
+        return True
+
+    def stop(self):
+        self.events.close()
+        self.ingest_queue.stop()
+        for watcher in self.watchers:
+            watcher.stop()
+
+    @property
+    def watching(self):
+        return bool(self.watchers) and all(w.is_alive() for w in self.watchers)
+
+    # --- Grouping ---
+
+    @staticmethod
+    def _key(record):
+        invoice_no = record.get("invoice_no") or ""
+        return ("no", invoice_no) if invoice_no else ("file", record["filename"])
+
+    def _regroup(self, key):
+        names = self._groups.get(key)
+        if not names:
+            self._groups.pop(key, None)
+            self._rows.pop(key, None)
+            return
+        ordered = sorted(names)
+        first = self._records[ordered[0]]
+        row = {"key": row_key(key), "invoice_no": key[1] if key[0] == "no" else ""}
+        for field in AGG_FIELDS:
+            row[field] = _blank(first.get(field))
+        row["quarter"] = get_quarter(str(row["date"]))
+        row["filename"] = ", ".join(ordered)
+        row["count"] = len(ordered)
+        self._rows[key] = row
+
+    def _put(self, filename, record):
+        """
+        Sets (record) or clears (None) one file; returns the affected group keys.
+        """
+        keys = set()
+        old = self._records.pop(filename, None)
+        if old is not None:
+            key = self._key(old)
+            self._groups[key].discard(filename)
+            keys.add(key)
+        if record is not None:
+            record = dict(record, filename=filename)
+            self._records[filename] = record
+            key = self._key(record)
+            self._groups.setdefault(key, set()).add(filename)
+            keys.add(key)
+        self.duplicates.put(filename, record)
+        return keys
+
+    def apply(self, changes):
+        """
+        Applies {filename: record or None} and regroups only the touched
+        groups. Records equal to the held ones are no change: they neither
+        bump the version nor publish an event.
+        """
+        with self._lock:
+            dirty = set()
+            files = {"added": [], "updated": [], "removed": []}
+            for filename, record in changes.items():
+                old = self._records.get(filename)
+                unchanged = old is None if record is None else old == dict(record, filename=filename)
+                if unchanged:
+                    continue
+                dirty |= self._put(filename, record)
+                files["removed" if record is None else "updated" if old is not None else "added"].append(filename)
+            for key in dirty:
+                self._regroup(key)
+            if dirty:
+                self.version += 1
+                self._publish(dirty, files)
+
+    def _publish(self, dirty, files):
+        self.events.publish("change", dict(self.delta(dirty), files=files))
+        peers = {}
+        for filename in files["added"] + files["updated"]:
+            names = self.duplicates.peers(filename)
+            if names:
+                peers[filename] = names
+        if peers:
+            self.events.publish("duplicates", {"version": self.version, "files": peers})
+
+    def load(self, data_list, since=None):
+        """
+        Reconciles the view with a full scan result. Files the watcher updated
+        after `since` (scan start time) are newer than the scan and kept as is.
+        """
+        with self._lock:
+            scanned = {r["filename"]: r for r in data_list}
+            changes = {}
+            for filename in self._records.keys() | scanned.keys():
+                if since is not None and self._touched.get(filename, 0) > since:
+                    continue
+                record = scanned.get(filename)
+                if record != self._records.get(filename):
+                    changes[filename] = record
+            self.apply(changes)
+
+    # --- Feeds ---
+
+    def refresh(self, filenames, digests=None, force=False):
+        """
+        Re-indexes specific files of input_dir and applies the result
+        (force: re-parse them even if indexed).
+        """
+        changes = update_files(self.input_dir, filenames, digests=digests, force=force)
+        with self._lock:
+            # Later-page invoices the files no longer have
+            for filename in filenames:
+                for key in self.record_keys(filename)[1:]:
+                    changes.setdefault(key, None)
+            now = time.time()
+            for filename in changes:
+                self._touched[filename] = now
+            self.apply(changes)
+        return changes
+
+    def record_keys(self, filename):
+        """
+        Keys of the records held for one file: the file key, then the
+        "#p<n>" keys of a multi-invoice PDF's later pages.
+        """
+        with self._lock:
+            keys = [filename]
+            page = 2
+            while f"{filename}#p{page}" in self._records:
+                keys.append(f"{filename}#p{page}")
+                page += 1
+            return keys
+
+    def ingest(self, filename, digest=None):
+        """
+        Queues a newly written file for background extraction.
+        """
+        self.ingest_queue.submit(filename, digest)
+
+    def _ingest(self, digests):
+        self.refresh(list(digests), {f: d for f, d in digests.items() if d})
+
+    def _on_fs_change(self, prefix, names):
+        if names is None:
+            # Events were lost: fall back to a full reconciliation scan
+            from jobs import scan_jobs
+            scan_jobs.start(self.input_dir)
+            return
+        # Files queued for ingest are indexed by the ingest worker
+        names = {prefix + n for n in names if n.lower().endswith(INVOICE_EXTENSIONS)}
+        names = {n for n in names if not self.ingest_queue.is_pending(n)}
+        if names:
+            self.refresh(names)
+
+    def scan_record(self, job, record):
+        if job.input_dir != self.input_dir:
+            return
+        if record is not None:
+            self.apply({record["filename"]: record})
+        self.events.publish("scan", job.progress(), every=PROGRESS_INTERVAL)
+
+    def scan_finished(self, job):
+        if job.input_dir != self.input_dir:
+            return
+        if job.status == "done":
+            self.load(job.snapshot_records(), since=job.started_at)
+        self.events.publish("scan", job.progress())
+
+    # --- Reads ---
+
+    def rows(self):
+        """
+        Returns the grouped rows sorted like process_invoices (quarter, purchaser).
+        """
+        return self._versioned_rows()[1]
+
+    def _versioned_rows(self):
+        """
+        (version, rows()) read together under the lock, so the rows are the
+        ones of that version. Rows are replaced on change, never edited, so
+        copying the references is enough.
+        """
+        with self._lock:
+            version = self.version
+            items = list(self._rows.items())
+        items.sort(key=lambda kv: (kv[1]["quarter"], kv[1]["purchaser"], kv[0][0] == "file", kv[0][1]))
+        return version, [row for _, row in items]
+
+    def group_keys(self, filenames):
+        """
+        Keys of the groups holding the records of the given files (later pages included).
+        """
+        with self._lock:
+            return {self._key(self._records[k]) for f in filenames for k in self.record_keys(f) if k in self._records}
+
+    def delta(self, keys):
+        """
+        Current state of the given groups, for clients patching their copy:
+        {"version", "rows": rows still present, "removed": row keys gone}.
+        """
+        with self._lock:
+            return {
+                "version": self.version,
+                "rows": [self._rows[k] for k in sorted(keys) if k in self._rows],
+                "removed": [row_key(k) for k in sorted(keys) if k not in self._rows],
+            }
+
+    def duplicate_groups(self):
+        """
+        Returns lists of duplicate filenames (same invoice number or same content).
+        """
+        with self._lock:
+            return self.duplicates.groups()
+
+    def select(self, purchaser=None, quarter=None, seller=None, min_amount=None, max_amount=None,
+               search=None, sort=None):
+        """
+        Returns the grouped rows matching every given filter. Exact match on
+        purchaser/quarter/seller ("" matches a missing value), inclusive amount
+        range, case-insensitive substring search. sort is one of SORT_KEYS,
+        "-" prefixed for descending; default is the rows() order.
+        """
+        return _filter_rows(self.rows(), purchaser, quarter, seller, min_amount, max_amount, search, sort)
+
+    def query(self, offset=0, limit=None, **filters):
+        """
+        Returns (version, total matches, JSON bytes of rows[offset:offset+limit]).
+        Serialized pages are cached until the index changes.
+        """
+        if not any(v is not None for v in filters.values()) and not offset and limit is None:
+            return self.snapshot()
+        params = (offset, limit, tuple(sorted(filters.items())))
+        with self._lock:
+            version = self.version
+            hit = self._queries.get((version,) + params)
+        if hit is not None:
+            return (version,) + hit
+        version, rows = self._versioned_rows()
+        rows = _filter_rows(rows, **filters)
+        window = rows[offset:offset + limit] if limit is not None else rows[offset:]
+        result = (len(rows), json.dumps(window, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            if self.version == version:
+                # Results of older versions can never be served again
+                self._queries = {k: v for k, v in self._queries.items() if k[0] == version}
+                if len(self._queries) >= MAX_CACHED_QUERIES:
+                    self._queries.pop(next(iter(self._queries)))
+                self._queries[(version,) + params] = result
+        return (version,) + result
+
+    def snapshot(self):
+        """
+        Returns (version, row count, JSON bytes) of the grouped rows, rebuilt
+        only when changed.
+        """
+        with self._lock:
+            if self._snapshot[0] == self.version:
+                return self._snapshot
+        version, rows = self._versioned_rows()
+        snapshot = (version, len(rows), json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            if version >= self._snapshot[0]:
+                self._snapshot = snapshot
+        return snapshot
@@ -1,43 +1,88 @@
 import pdfplumber
 import pandas as pd
+import io
 import os
 import re
+import json
+import zlib
+import hashlib
+import time
+import sys
+import fnmatch
 import logging
 from datetime import datetime
-from openpyxl.utils import get_column_letter
+from concurrent.futures import ProcessPoolExecutor
+from invoice_index import open_index
+from supervisor import supervised_map
+from metrics import SCAN_SECONDS, FILES_RESOLVED, EXTRACTION_FAILURES, FILES_QUARANTINED, WORKER_RECYCLES
+from summary import write_summary, format_for
+from xml_invoice import parse_xml_file, parse_ofd, parse_invoice_xml, pdf_xml_attachments
+from rules import InvoiceText, PageLayout, apply_rules, take_rule_stats, merge_rule_stats, FIELD_ORDER, EXTRACTOR_VERSION
 
 # --- CONFIGURATION ---
 INPUT_DIR = "fp"
 OUTPUT_FILE = "invoice_summary.xlsx"
 LOG_FILE = "extraction.log"
 
-# Setup Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
+# Parallel extraction (cold scans are CPU-bound in pdfplumber)
+SCAN_WORKERS = int(os.environ.get("LAZYFP_SCAN_WORKERS", 0)) or os.cpu_count() or 1
+SCAN_CHUNKSIZE = int(os.environ.get("LAZYFP_SCAN_CHUNKSIZE", 4))
+
+# Extraction runs in supervised worker processes (supervisor.py), so a file that
+# makes pdfplumber spin or balloon cannot stall or OOM the server: a file still
+# parsing after EXTRACT_TIMEOUT seconds, or whose worker grows past
+# WORKER_RSS_LIMIT_MB, has its worker killed and is quarantined until its content
+# changes. Workers are replaced after WORKER_MAX_FILES files or once their RSS
+# reaches WORKER_RECYCLE_MB. LAZYFP_EXTRACT_ISOLATION=0 extracts in-process instead.
+EXTRACT_TIMEOUT = float(os.environ.get("LAZYFP_EXTRACT_TIMEOUT", 120))
+WORKER_RSS_LIMIT_MB = int(os.environ.get("LAZYFP_WORKER_RSS_LIMIT_MB", 2048))
+WORKER_MAX_FILES = int(os.environ.get("LAZYFP_WORKER_MAX_FILES", 500))
+WORKER_RECYCLE_MB = int(os.environ.get("LAZYFP_WORKER_RECYCLE_MB", 1024))
+EXTRACT_ISOLATION = os.environ.get("LAZYFP_EXTRACT_ISOLATION", "1") != "0"
+
+# Multi-page PDFs: at most PAGE_LIMIT pages are read per file. A multi-invoice PDF
+# parsed on its own (upload, single changed file) has its pages split across
+# PAGE_WORKERS processes once more than PAGE_PARALLEL_MIN pages remain after the first two.
+PAGE_LIMIT = int(os.environ.get("LAZYFP_PAGE_LIMIT", 200))
+# Pages read at most to complete one invoice that continues past page 1 (statements)
+CONTINUATION_LIMIT = int(os.environ.get("LAZYFP_CONTINUATION_PAGES", 4))
+PAGE_WORKERS = int(os.environ.get("LAZYFP_PAGE_WORKERS", 0)) or SCAN_WORKERS
+PAGE_PARALLEL_MIN = 8
+
+# Invoice files picked up by scans and uploads. Structured XML/OFD invoices (and
+# XML attached to a PDF) are read field by field; PDF text is the fallback.
+INVOICE_EXTENSIONS = (".pdf", ".xml", ".ofd")
+
+# Folder scanning: subfolders are walked unless LAZYFP_SCAN_RECURSIVE=0.
+# Folders whose name or root-relative path matches an exclude pattern are skipped.
+SCAN_RECURSIVE = os.environ.get("LAZYFP_SCAN_RECURSIVE", "1") != "0"
+SCAN_EXCLUDE = [p.strip() for p in os.environ.get("LAZYFP_SCAN_EXCLUDE", "dump,organized").split(",") if p.strip()]
+
+# More folders scanned together with INPUT_DIR, as name=path entries separated by
+# os.pathsep (e.g. "archive=/mnt/archive:hr=/srv/hr"). Their files are keyed "@name/<relative path>".
+EXTRA_ROOTS = dict(
+    entry.split("=", 1) for entry in os.environ.get("LAZYFP_EXTRA_ROOTS", "").split(os.pathsep) if "=" in entry
 )
 
-def clean_name(n):
+# Set by setup_logging; extraction workers then set up the same logging
+_file_logging = False
+
+def setup_logging():
     """
-    Cleans and validates company names.
-    Returns None if invalid.
+    Logs to LOG_FILE and stderr. Run at startup by the CLI and the web app
+    rather than on import, so scripts importing this module keep their own
+    logging setup (and stay out of the service log).
     """
-    if not n: return None
-    # Remove all whitespace
-    n = re.sub(r"[\s\u3000\xa0]+", "", n)
-    # Remove artifacts
-    for char in ["名称", "购买方", "销售方", "名", "称", "：", ":", "购", "买", "售", "方"]:
-         n = n.replace(char, "")
-    
-    # Validation
-    if len(n) < 4: return None
-    if re.match(r"^\d+$", n): return None # All digits
-    if "机器编号" in n or "税务局" in n: return None # Junk
-    return n
+    global _file_logging
+    _file_logging = True
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE),
+            logging.StreamHandler()
+        ]
+    )
 
 def get_quarter(date_str):
     """
@@ -66,9 +111,11 @@ def get_quarter(date_str):
              except: pass
         return "Unknown"
 
-def extract_invoice_data(pdf_path):
+def extract_fields(text, layout, filename, profile=None):
     """
-    Extracts key fields from a single invoice PDF.
+    Field stage of extraction: runs the rules of rules.py over one page's
+    text (and char layout, for the spatial fallbacks). Needs no PDF, so
+    records can be re-derived from a stored text layer.
     """
     data = {
         "invoice_no": None,
@@ -76,388 +123,727 @@ def extract_invoice_data(pdf_path):
         "purchaser": None,
         "seller": None,
         "total_amount": None,
-        "filename": os.path.basename(pdf_path)
+        "filename": filename
     }
-    
+    if not text:
+        return data
+
+    timings = profile if profile is not None else {}
+    t0 = time.perf_counter()
+    ctx = InvoiceText(text, layout=layout)
+    data.update(apply_rules(ctx))
+    timings["rules"] = time.perf_counter() - t0
+    timings["spatial"] = ctx.spatial_seconds
+    timings["sources"] = dict(ctx.sources)
+
+    # HOTFIX: Known legacy file with unparseable date text
+    if "拼多多商家电子发票-74.pdf" in data["filename"] and not data["date"]:
+         data["date"] = "2022年10月17日" # Manually verified from PDF visual
+
+    return data
+
+def pack_text_layer(pages, count, structured=None):
+    """
+    Serializes the pages read from a PDF ([(text, layout)], in page order),
+    its (bounded) page count and the fields read from structured XML, if
+    any, for the index, as zlib-compressed JSON.
+    """
+    layer = {"count": count, "pages": []}
+    if structured:
+        layer["structured"] = structured
+    for text, layout in pages:
+        page = {"text": text}
+        if layout is not None:
+            page.update(width=layout.width, height=layout.height, chars=layout.chars)
+        layer["pages"].append(page)
+    return zlib.compress(json.dumps(layer, ensure_ascii=False).encode("utf-8"))
+
+def unpack_text_layer(blob):
+    """
+    Returns ([(text, layout)], page count, structured fields or None) from pack_text_layer output.
+    Raises LookupError for layers stored in an older format.
+    """
+    layer = json.loads(zlib.decompress(blob))
+    if "pages" not in layer:
+        raise LookupError("text layer predates multi-page extraction")
+    pages = []
+    for page in layer["pages"]:
+        layout = None
+        if "chars" in page:
+            layout = PageLayout(page["width"], page["height"], [tuple(c) for c in page["chars"]])
+        pages.append((page["text"], layout))
+    return pages, layer["count"], layer.get("structured")
+
+def _settled(data):
+    return all(data.get(field) is not None for field in FIELD_ORDER)
+
+def apply_structured(structured, records, filename):
+    """
+    Overlays fields read from invoice XML on the first record: structured
+    values win, the text path only fills what the XML lacks.
+    """
+    if not structured:
+        return records
+    first = dict(records[0]) if records else extract_fields("", None, filename)
+    for field in FIELD_ORDER:
+        if structured.get(field) is not None:
+            first[field] = structured[field]
+    return [first] + records[1:]
+
+def _separate_invoice(first, page):
+    """
+    True if a later page carries an invoice of its own (its own number,
+    different from the first page's) rather than continuing the first one.
+    """
+    return bool(page.get("invoice_no")) and page.get("invoice_no") != first.get("invoice_no")
+
+def page_records(read, count, fields, rest=None):
+    """
+    Combines the pages of one PDF into records, reading as few pages as possible:
+    - one page: one record;
+    - page 2 holds another invoice number: a multi-invoice PDF, every page is
+      its own record (tagged "page"). rest(indices) may extract pages 3.. in
+      bulk (e.g. in parallel) and return their fields in order;
+    - otherwise later pages continue the first invoice (statements): fields
+      page 1 leaves empty are filled from the text of the pages read so far,
+      reading on (up to CONTINUATION_LIMIT pages) until every field is settled.
+    read(i) returns (text, layout) of page i (0-based); fields(text, layout)
+    runs the field stage.
+    """
+    first_page = read(0)
+    first = fields(*first_page)
+    if count == 1:
+        return [first]
+    second_page = read(1)
+    second = fields(*second_page)
+    if _separate_invoice(first, second):
+        tail = range(2, count)
+        records = [first, second] + (rest(tail) if rest is not None else [fields(*read(i)) for i in tail])
+        for number, record in enumerate(records, 1):
+            record["page"] = number
+        return records
+
+    merged = dict(first)
+    texts = [first_page[0], second_page[0]]
+    limit = min(count, CONTINUATION_LIMIT)
+    while True:
+        # Rules see the pages together (labels on one page, values on another);
+        # the spatial rules keep page 1's layout
+        joined = fields("\n".join(t for t in texts if t), first_page[1])
+        for field in FIELD_ORDER:
+            if merged.get(field) is None:
+                merged[field] = joined.get(field)
+        if _settled(merged) or len(texts) >= limit:
+            return [merged]
+        texts.append(read(len(texts))[0])
+
+def _read_page(pdf, i, filename, timings):
+    """
+    Text and char layout of page i of an open PDF. The page's parsed objects
+    are released once read, so long files are never held in memory whole.
+    """
+    page = pdf.pages[i]
+    t0 = time.perf_counter()
+    text = page.extract_text() or ""
+    t1 = time.perf_counter()
+    # Captured up front (chars are already parsed by extract_text) so the
+    # stored text layer can serve the spatial rules after an upgrade
+    layout = PageLayout.from_page(page) if text else None
+    page.close()
+    timings["extract_text"] = timings.get("extract_text", 0.0) + t1 - t0
+    timings["layout"] = timings.get("layout", 0.0) + time.perf_counter() - t1
+    if not text:
+        logging.warning(f"File {filename} has no extractable text on page {i + 1}.")
+    return text, layout
+
+def _page_fields(text, layout, filename, timings):
+    """
+    extract_fields for one page, adding its rule and spatial time to timings
+    (the first page's rule sources are kept).
+    """
+    page_timings = {}
+    data = extract_fields(text, layout, filename, profile=page_timings)
+    for key in ("rules", "spatial"):
+        timings[key] = timings.get(key, 0.0) + page_timings.get(key, 0.0)
+    timings.setdefault("sources", page_timings.get("sources", {}))
+    return data
+
+def _extract_pages(pdf_path, indices):
+    """
+    Pool entry point for page-parallel extraction: opens only the given
+    pages (0-based) and returns ([(fields, text, layout)], rule stats).
+    """
+    filename = os.path.basename(pdf_path)
+    timings = {}
+    out = []
+    with pdfplumber.open(pdf_path, pages=[i + 1 for i in indices]) as pdf:
+        for i in range(len(indices)):
+            text, layout = _read_page(pdf, i, filename, timings)
+            out.append((_page_fields(text, layout, filename, timings), text, layout))
+    return out, take_rule_stats()
+
+def _parallel_pages(pdf_path, indices, workers, pages):
+    """
+    Extracts the given pages in `workers` processes, in contiguous slices.
+    Appends (text, layout) to pages and returns the fields, in page order.
+    """
+    indices = list(indices)
+    size = -(-len(indices) // workers)
+    slices = [indices[i:i + size] for i in range(0, len(indices), size)]
+    fields = []
+    with ProcessPoolExecutor(max_workers=len(slices)) as pool:
+        for out, stats in pool.map(_extract_pages, [pdf_path] * len(slices), slices):
+            merge_rule_stats(stats)
+            for data, text, layout in out:
+                fields.append(data)
+                pages.append((text, layout))
+    return fields
+
+def _embedded_fields(pdf, filename):
+    """
+    Fields of the invoice XML attached to an open PDF ({} without one).
+    """
+    fields = {}
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            if not pdf.pages:
-                logging.warning(f"File {data['filename']} has no pages.")
-                return data
-                
-            page = pdf.pages[0]
-            text = page.extract_text() or ""
-            
-            if not text:
-                 logging.warning(f"File {data['filename']} has no extractable text.")
-                 return data
-
-            # Basic Regex
-            inv_match = re.search(r"发\s*票\s*号\s*码[:：]\s*(\d+)", text)
-            if inv_match: data["invoice_no"] = inv_match.group(1)
-                
-            date_match = re.search(r"开\s*票\s*日\s*期[:：]\s*(\S+)", text)
-            if date_match: data["date"] = date_match.group(1)
-                
-            amount_match = re.search(r"小\s*写.*?[¥￥]?\s*([\d,]+\.?\d*)", text)
-            if amount_match:
-                 try: data["total_amount"] = float(amount_match.group(1).replace(',', ''))
-                 except: pass
-            
-            # Simplified Fallback for Amount
-            if data["total_amount"] is None:
-                 match = re.search(r"价\s*税\s*合\s*计.*?[¥￥]?\s*([\d,]+\.?\d*)", text)
-                 if match and "大写" not in match.group(): 
-                      try: data["total_amount"] = float(match.group(1).replace(',', ''))
-                      except: pass
-
-            # Generate Flat Text Early
-            text_flat = re.sub(r"[\s\u3000\xa0]+", "", text)
-            
-            # --- Name Extraction Strategy ---
-            # 0. Robust Flat Text Search (Handles spaces in names best)
-            # Pattern: Purchaser Name is between "购名称" and "销名称" or "纳税"
-            # Pattern: Seller Name is between "销名称" and "买售" or "纳税"
-            
-            # Purchaser
-            if not data["purchaser"]:
-                 # Try "购名称" or just "名称" at start
-                 # Look for: (?:购)?名称[:：](.+?)(?:销|售|卖|纳税|统一|地址|开户)
-                 match_p = re.search(r"(?:购)?名称[:：](.+?)(?:销|售|卖|纳税|统一|地址|开户)", text_flat)
-                 if match_p:
-                      data["purchaser"] = match_p.group(1)
-            
-            # Seller
-            if not data["seller"]:
-                 # Look for: (?:销|售)名称[:：](.+?)(?:买售|纳税|统一|地址|开户|复核)
-                 # Note: in mubai222, it ends with "买售"
-                 match_s = re.search(r"(?:销|售)名称[:：](.+?)(?:买售|纳税|统一|地址|开户|复核|开票)", text_flat)
-                 if match_s:
-                      data["seller"] = match_s.group(1)
-                 else:
-                      # Try second "名称" if no explicit "销名称" found (common in simple invoices)
-                      # Find all "名称" indices
-                      pass 
-
-            # 1. Look for explicit "名称: Value" (Original Text - Backup)
-            if not data["purchaser"] or not data["seller"]:
-                 name_matches = list(re.finditer(r"名\s*称\s*[:：]\s*([^\s]+)", text))
-                 if len(name_matches) >= 2:
-                     if not data["purchaser"]: data["purchaser"] = name_matches[0].group(1)
-                     if not data["seller"]: data["seller"] = name_matches[1].group(1)
-                 elif len(name_matches) == 1:
-                     if not data["purchaser"]: data["purchaser"] = name_matches[0].group(1)
-                
-            # 2. Loose matches "名称 Value"
-            if not data["purchaser"] or not data["seller"]:
-                 loose_matches = list(re.finditer(r"名\s*称\s*[:：]?\s+([^\s:：]+)", text))
-                 if len(loose_matches) >= 2:
-                      if not data["purchaser"]: data["purchaser"] = loose_matches[0].group(1)
-                      if not data["seller"]: data["seller"] = loose_matches[1].group(1)
-                 elif len(loose_matches) == 1:
-                      if not data["purchaser"]: data["purchaser"] = loose_matches[0].group(1)
-
-            # Validation / Cleanup
-            data["purchaser"] = clean_name(data["purchaser"])
-            data["seller"] = clean_name(data["seller"])
-
-            # --- FALLBACK 1: SPATIAL EXTRACTION ---
-            if not data["purchaser"] or not data["seller"]:
-                 width, height = page.width, page.height
-                 
-                 # Purchaser (Left Box)
-                 if not data["purchaser"]:
-                     left_box = (0, height*0.15, width*0.55, height*0.60)
-                     left_text = page.within_bbox(left_box).extract_text()
-                     if left_text:
-                         cand_match = re.search(r"([^\n]{2,30}公司)", left_text)
-                         if cand_match: data["purchaser"] = cand_match.group(1).strip()
-
-                 # Seller (Right Box - Top & Bottom)
-                 if not data["seller"]:
-                     # Top Right
-                     right_box = (width*0.45, height*0.15, width, height*0.60)
-                     right_text = page.within_bbox(right_box).extract_text() or ""
-                     cand_match = re.search(r"([^\n]{2,30}公司)", right_text)
-                     if cand_match:
-                          cand = cand_match.group(1).strip()
-                          if not data["purchaser"] or cand not in data["purchaser"]:
-                               data["seller"] = cand
-                     
-                     # Bottom check (if not found top)
-                     if not data["seller"]:
-                          bottom_box = (0, height*0.60, width, height*0.95)
-                          bot_text = page.within_bbox(bottom_box).extract_text() or ""
-                          cand_matches = re.finditer(r"([^\n]{4,30}公司)", bot_text)
-                          for m in cand_matches:
-                               cand = m.group(1).strip()
-                               if data["purchaser"] and cand in data["purchaser"]: continue
-                               if "咨询" in cand and data["purchaser"] and "咨询" in data["purchaser"]: continue
-                               data["seller"] = cand
-                               break
-
-            # --- FLATTENED TEXT ANALYSIS (Final Line of Defense) ---
-            # Use regex to remove ALL whitespace
-            text_flat = re.sub(r"[\s\u3000\xa0]+", "", text)
-            
-            # Date Fallbacks (Sequential)
-            if not data["date"]:
-                 # 1. Try YYYY年MM月DD日 on flat text
-                 d_match = re.search(r"(20\d{2}年\d{1,2}月\d{1,2}日)", text_flat)
-                 if d_match: data["date"] = d_match.group(1)
-
-            if not data["date"]:
-                 # 2. Aggressive 8-digit Date in Flat Text (202xMMDD)
-                 # 20xxMMDD -> 20\d{6}
-                 all_dates = re.findall(r"(20\d{6})", text_flat)
-                 for d in all_dates:
-                      # Check capture
-                      y, m, day = d[:4], d[4:6], d[6:]
-                      if int(m) <= 12 and int(day) <= 31: # Basic validation
-                           data["date"] = f"{y}年{m}月{day}日"
-                           break
-
-            if not data["date"]:
-                 # 3. Contextual Search "开票日期"
-                 match_ctx = re.search(r"开票日期[:：]?\D{0,15}(20\d{2}\s*\d{1,2}\s*\d{1,2})", text)
-                 if match_ctx:
-                       raw = match_ctx.group(1).replace(" ", "")
-                       if len(raw) == 8:
-                            data["date"] = f"{raw[:4]}年{raw[4:6]}月{raw[6:]}日"
-
-            if not data["date"]:
-                 # 4. "Digital DNA" - formatting destruction
-                 # Extract ALL digits in the doc and look for date pattern
-                 # This handles "2 0 2 2 1 0 1 7"
-                 all_digits = "".join(re.findall(r"\d", text))
-                 # Pattern: 202x MM DD
-                 # Avoid phone numbers (11 digits) or IDs (18 digits)
-                 # Look for 202x followed by valid month/day
-                 matches = re.finditer(r"(20[23]\d)(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])", all_digits)
-                 for m in matches:
-                      # We found a valid YYYYMMDD sequence
-                      data["date"] = f"{m.group(1)}年{m.group(2)}月{m.group(3)}日"
-                      break
-
-            # Format Date for Quarter Calculation
-            if data["date"] and " " in data["date"]:
-                 parts = data["date"].split()
-                 if len(parts) == 3:
-                      data["date"] = f"{parts[0]}年{parts[1]}月{parts[2]}日"
-
-            # Check validity of Date
-            if data["date"]:
-                 if not re.search(r"\d", data["date"]): data["date"] = None
-                 elif len(data["date"]) < 6: data["date"] = None
-
-            if not data["date"]:
-                  # Last try: standard regex re-scan just in case
-                  d_match = re.search(r"(\d{4}年\d{1,2}月\d{1,2}日)", text)
-                  if d_match: data["date"] = d_match.group(1)
-
-            # Invoice No Fallback
-            # Correct logic: 20 digit is king for digital invoices.
-            if not data["invoice_no"] or len(data["invoice_no"]) < 10:
-                 # Check for 20 digits first (Most reliable)
-                 nums_20 = re.findall(r"\b\d{20}\b", text)
-                 if nums_20:
-                      data["invoice_no"] = nums_20[0]
-                 
-            # 1. Invoice Number (发票号码)
-            # Standard Invoice
-            m_no = re.search(r"发票号码[:：]?\s*(\d{20}|\d{8,12})", text_flat)
-            if m_no:
-                data["invoice_no"] = m_no.group(1)
-            else:
-                # Fallback for China Mobile Statements (对账单)
-                # Try Customer Account (客户账号) or Group ID (集团编号) which act as unique IDs here
-                # Priority: 客户账号 -> 集团编号
-                m_acc = re.search(r"客户账号[:：]?\s*(\d+)", text_flat)
-                m_grp = re.search(r"集团编号[:：]?\s*(\d+)", text_flat)
-                
-                if m_acc:
-                     data["invoice_no"] = m_acc.group(1)
-                elif m_grp:
-                     data["invoice_no"] = m_grp.group(1)
-                # Try just finding a long number at top matching filename patterns? 
-                # No, that's risky.
-
-            if not data["invoice_no"] or (len(data["invoice_no"]) == 12 and data["invoice_no"].startswith("0")):
-                 match_no = re.search(r"号码[:：]?(\d{8,20})", text_flat)
-                 if match_no: 
-                      cand = match_no.group(1)
-                      # Only accept if it looks like a valid number (>8 digits)
-                      if len(cand) >= 8: data["invoice_no"] = cand
-                 else:
-                      # Unified Invoice Monitor (Older format)
-                      if not data["invoice_no"] or data["invoice_no"].startswith("0440"):
-                           match_monitor = re.search(r"监\s*(\d{8})\b", text)
-                           if match_monitor: data["invoice_no"] = match_monitor.group(1)
-                      # Final loose check for 8 digits
-                      if not data["invoice_no"]:
-                           nums_8 = re.findall(r"\b(\d{8})\b", text)
-                           for n in nums_8:
-                                if n.startswith("202"): continue 
-                                data["invoice_no"] = n
-                                break
-
-            # Amount Fallback (Flat)
-            if not data["total_amount"]:
-                 match_amt = re.search(r"(小写|价税合计)\D{0,50}([¥￥]?\d+\.?\d{2})", text_flat)
-                 if match_amt:
-                      try: 
-                           raw_amt = match_amt.group(2).replace("¥", "").replace("￥", "")
-                           val = float(raw_amt)
-                           if val < 100000000: # Sanity check
-                                data["total_amount"] = val
-                      except: pass
-                 
-                 # Chinese Currency Heuristic
-                 if not data["total_amount"]:
-                      match_cn = re.search(r"[壹贰叁肆伍陆柒捌玖拾佰仟万亿圆角分整]{2,}\D{0,10}([¥￥]?\d+\.?\d{2})", text_flat)
-                      if match_cn:
-                           try: 
-                                raw_amt = match_cn.group(1).replace("¥", "").replace("￥", "")
-                                val = float(raw_amt)
-                                if val < 100000000: # Sanity check
-                                     data["total_amount"] = val
-                           except: pass
-            
-            # Final Cleanups
-            data["purchaser"] = clean_name(data["purchaser"])
-            data["seller"] = clean_name(data["seller"])
-            
-            # Final check for Flat Text company names
-            if not data["seller"] or not data["purchaser"]:
-                  candidates_flat = re.findall(r"([\u4e00-\u9fa5()（）]{4,20}公司)", text_flat)
-                  for cand in candidates_flat:
-                       if not data["purchaser"]: data["purchaser"] = cand
-                       elif not data["seller"]:
-                            if data["purchaser"] and cand in data["purchaser"]: continue
-                            if "咨询" in cand and "咨询" in data["purchaser"]: continue
-                            data["seller"] = cand
-                            break
-
-            # HOTFIX: Known legacy file with unparseable date text
-            if "拼多多商家电子发票-74.pdf" in data["filename"] and not data["date"]:
-                 data["date"] = "2022年10月17日" # Manually verified from PDF visual
+        for _, data in pdf_xml_attachments(pdf.doc):
+            for field, value in parse_invoice_xml(io.BytesIO(data)).items():
+                fields.setdefault(field, value)
+    except Exception as e:
+        logging.warning(f"Cannot read the attachments of {filename}: {e}")
+    return fields
+
+def _read_structured(path):
+    """
+    Reads a standalone .xml/.ofd invoice. Returns (fields, pages): an OFD whose
+    metadata lacks fields also yields its page text, as one text-only page.
+    """
+    if path.lower().endswith(".ofd"):
+        fields, text = parse_ofd(path)
+        return fields, [(text, None)] if text else []
+    return parse_xml_file(path), []
+
+def extract_invoices(pdf_path, profile=None, layer=None, workers=1):
+    """
+    Extracts the invoices of one file: usually one record, one per page for
+    multi-invoice PDFs (see page_records). Fields of structured invoices
+    (.xml, .ofd, XML attached to a PDF) are read from the XML; the text
+    rules only fill what it lacks, and PDF pages are not read at all when
+    the XML holds every field. Pages are opened lazily and at most
+    PAGE_LIMIT are read. With workers > 1, the pages of a long
+    multi-invoice PDF are extracted in parallel processes.
+    Pass a dict as `profile` to receive phase timings (open, structured,
+    extract_text, layout, rules, spatial, summed over pages), the pages read
+    and the rule that produced each field of the first page (sources).
+    Pass a dict as `layer` to receive the packed text layer ("blob") the
+    fields were extracted from; it stays empty when the file failed to parse.
+    """
+    filename = os.path.basename(pdf_path)
+    timings = profile if profile is not None else {}
+    pages = []  # (text, layout) of the pages read, in page order
+    fields = lambda text, layout: _page_fields(text, layout, filename, timings)
+    try:
+        t0 = time.perf_counter()
+        if not pdf_path.lower().endswith(".pdf"):
+            structured, pages = _read_structured(pdf_path)
+            count = len(pages)
+            timings["structured"] = time.perf_counter() - t0
+            if not structured and not count:
+                logging.warning(f"File {filename} holds no invoice fields.")
+            records = page_records(pages.__getitem__, count, fields) if count else [extract_fields("", None, filename)]
+        else:
+            with pdfplumber.open(pdf_path) as pdf:
+                count = min(len(pdf.pages), PAGE_LIMIT)
+                t1 = time.perf_counter()
+                timings["open"] = t1 - t0
+                structured = _embedded_fields(pdf, filename)
+                timings["structured"] = time.perf_counter() - t1
+                if _settled(structured):
+                    records = [extract_fields("", None, filename)]
+                elif not count:
+                    logging.warning(f"File {filename} has no pages.")
+                    records = [extract_fields("", None, filename)]
+                else:
+                    def read(i):
+                        pages.append(_read_page(pdf, i, filename, timings))
+                        return pages[-1]
+
+                    rest = None
+                    if workers > 1 and count - 2 >= PAGE_PARALLEL_MIN:
+                        rest = lambda indices: _parallel_pages(pdf_path, indices, workers, pages)
+                    records = page_records(read, count, fields, rest)
+
+        records = apply_structured(structured, records, filename)
+        timings["pages"] = len(pages)
+        if layer is not None:
+            layer["blob"] = pack_text_layer(pages, count, structured)
 
     except Exception as e:
-        logging.error(f"Critical error parsing {data['filename']}: {e}")
-    
-    return data
+        logging.error(f"Critical error parsing {filename}: {e}")
+        timings["error"] = str(e)
+        records = [extract_fields("", None, filename)]
 
-CACHE_FILE = "invoice_cache.json"
+    return records
 
-def scan_directory(input_dir):
+def extract_invoice_data(pdf_path, profile=None, layer=None):
     """
-    Scans PDF files in input_dir, extracts data, and returns a list of dictionaries.
-    Uses generic 'process_pdf' internally or we just fold the logic here.
-    Now with INCREMENTAL CACHING.
+    Extracts key fields from a single invoice PDF: the first invoice of
+    extract_invoices (continuation pages included).
+    Field logic lives in the ordered rule tables of rules.py.
     """
-    import json
-    import os
-    import pandas as pd
-    
-    # Load Cache
-    cache = {}
-    if os.path.exists(CACHE_FILE):
+    return extract_invoices(pdf_path, profile=profile, layer=layer)[0]
+
+def rederive_invoices(blob, filename):
+    """
+    Re-runs the field stage over a stored text layer. Raises LookupError when
+    the current rules need a page that was not stored (re-parse the PDF then).
+    """
+    stored, count, structured = unpack_text_layer(blob)
+
+    def read(i):
+        if i >= len(stored):
+            raise LookupError(f"page {i + 1} not in the stored text layer")
+        return stored[i]
+
+    if not count or _settled(structured or {}):
+        records = [extract_fields("", None, filename)]
+    else:
+        records = page_records(read, count, lambda text, layout: extract_fields(text, layout, filename))
+    return apply_structured(structured, records, filename)
+
+def _extract_in_worker(task):
+    """
+    Worker entry point: task is (path, page workers). Returns the records,
+    their text layer and the worker's rule stats.
+    """
+    pdf_path, workers = task
+    layer = {}
+    records = extract_invoices(pdf_path, layer=layer, workers=workers)
+    return records, layer.get("blob"), take_rule_stats()
+
+CACHE_FILE = "invoice_cache.json"  # Legacy, migrated into INDEX_FILE
+INDEX_FILE = "invoice_index.db"
+
+# Failures that quarantine a file: retrying it would most likely fail the same way
+QUARANTINE_KINDS = ("timeout", "memory", "crashed")
+
+def _iter_extract(paths, workers, chunksize, cancel=None):
+    """
+    Runs extract_invoices over paths in supervised worker processes (up to
+    `workers`; a lone file gets its pages extracted in parallel instead).
+    Yields (records, text layer blob or None, failure) in the same order as
+    paths; failure is None or (kind, reason), kind being "error" or one of
+    QUARANTINE_KINDS. Stops early once `cancel` is set.
+    """
+    page_workers = PAGE_WORKERS if workers > 1 and len(paths) == 1 else 1
+    workers = max(1, min(workers, len(paths)))
+    done = 0
+    if EXTRACT_ISOLATION:
+        if workers > 1:
+            logging.info(f"Extracting {len(paths)} files with {workers} worker processes...")
+        tasks = [(p, page_workers) for p in paths]
         try:
-            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                cache = json.load(f)
-        except Exception as e:
-            logging.error(f"Failed to load cache: {e}")
+            for path, (status, value) in zip(paths, supervised_map(
+                _extract_in_worker, tasks, workers, chunksize, cancel, timeout=EXTRACT_TIMEOUT,
+                rss_limit_mb=WORKER_RSS_LIMIT_MB, max_files=WORKER_MAX_FILES, recycle_mb=WORKER_RECYCLE_MB,
+                on_recycle=lambda cause: WORKER_RECYCLES.inc(1, cause),
+                initializer=setup_logging if _file_logging else None,
+            )):
+                done += 1
+                if status == "ok":
+                    res, blob, stats = value
+                    merge_rule_stats(stats)
+                    yield res, blob, None
+                else:
+                    logging.error(f"Extraction of {os.path.basename(path)} failed ({status}): {value}")
+                    yield [extract_fields("", None, os.path.basename(path))], None, (status, value)
+            return
+        except OSError as e:
+            # No worker could be started (process limit, no fork...): degrade to in-process
+            logging.error(f"Cannot start extraction workers ({e}), extracting in-process.")
+            paths = paths[done:]
+
+    for p in paths:
+        if cancel is not None and cancel.is_set():
+            return
+        layer = {}
+        res = extract_invoices(p, layer=layer, workers=page_workers)
+        yield res, layer.get("blob"), None
+
+def file_digest(path):
+    """
+    Returns the SHA-256 hex digest of a file's content.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
 
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
-    logging.info(f"Starting extraction for {len(files)} files found in '{input_dir}'...")
+def get_index():
+    """
+    Returns the invoice index, importing any JSON cache left by older versions.
+    """
+    index = open_index(INDEX_FILE)
+    index.migrate_json_cache(CACHE_FILE, INPUT_DIR, file_digest, get_quarter)
+    return index
 
-    data_list = []
-    
-    # Track current files to clean up cache later
-    current_files = set()
-    
-    # Pre-compile Regex
-    # (Regex patterns moved here or ensure they match what was there)
-    # Note: reusing the logic from the original main function would be best if we had process_pdf
-    # But since we are replacing process_invoices which typically wrapped the loop, we put the loop here.
-    
-    # We DO NOT want to duplicate the huge regex block if we can avoid it. 
-    # But in the previous turn `main.py` refactoring, `process_invoices` contained the loop 
-    # AND the extraction logic (the extraction logic wasn't in a separate helper function?).
-    # Let's check the viewed file content.
-    # Ah, `process_invoices` lines 331-407 contained the extraction logic.
-    # So I must include the extraction logic here or move it to a helper. 
-    # It is cleaner to move extraction to `extract_invoice_data(file_path)` but that function 
-    # in `main.py` (lines 136+) already exists!
-    # Let's verify if `extract_invoice_data` is robust and matches the fixes we made.
-    # The fix was in `extract_invoice_data` (lines ~125).
-    # So `process_invoices` should just call `extract_invoice_data`.
-    
-    updated_cache = False
-    
+def scan_roots(input_dir):
+    """
+    Returns [(key prefix, root path)] scanned for input_dir: the folder itself
+    (prefix "") plus EXTRA_ROOTS when input_dir is INPUT_DIR.
+    """
+    roots = [("", input_dir)]
+    if os.path.normpath(input_dir) == os.path.normpath(INPUT_DIR):
+        roots += [(f"@{name}/", path) for name, path in sorted(EXTRA_ROOTS.items())]
+    return roots
+
+def resolve_path(input_dir, key):
+    """
+    Maps a file key ("sub/dir/a.pdf" or "@root/sub/a.pdf") to its path on disk.
+    Raises ValueError for keys that would leave their root.
+    """
+    root = input_dir
+    rel = key
+    if key.startswith("@"):
+        name, _, rel = key[1:].partition("/")
+        if name not in EXTRA_ROOTS or os.path.normpath(input_dir) != os.path.normpath(INPUT_DIR):
+            raise ValueError(f"Unknown root in {key}")
+        root = EXTRA_ROOTS[name]
+    path = os.path.normpath(os.path.join(root, rel))
+    if os.path.isabs(rel) or os.path.relpath(path, root).split(os.sep)[0] == "..":
+        raise ValueError(f"Path escapes its root: {key}")
+    return path
+
+def is_excluded(rel_dir, exclude=None):
+    """
+    True if a folder (path relative to its root, "/"-separated) is skipped by scans.
+    """
+    exclude = SCAN_EXCLUDE if exclude is None else exclude
+    name = rel_dir.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel_dir, p) for p in exclude)
+
+def key_excluded(key):
+    """
+    True if scans would not pick up the file with this key (excluded folder,
+    or any subfolder when scanning is not recursive).
+    """
+    rel_dir = key.rpartition("/")[0]
+    if key.startswith("@"):
+        rel_dir = rel_dir.partition("/")[2]
+    if not rel_dir:
+        return False
+    if not SCAN_RECURSIVE:
+        return True
+    parts = rel_dir.split("/")
+    return any(is_excluded("/".join(parts[:i])) for i in range(1, len(parts) + 1))
+
+def iter_pdfs(root, recursive=None, exclude=None):
+    """
+    Walks root with os.scandir and yields (relative key, mtime, size) for each
+    invoice file (INVOICE_EXTENSIONS). Entry types come from the directory
+    listing; each invoice file is stat'ed once.
+    """
+    recursive = SCAN_RECURSIVE if recursive is None else recursive
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, rel_dir) if rel_dir else root) as entries:
+                for entry in entries:
+                    rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not is_excluded(rel, exclude):
+                            stack.append(rel)
+                    elif entry.name.lower().endswith(INVOICE_EXTENSIONS) and entry.is_file():
+                        st = entry.stat()
+                        yield rel, st.st_mtime, st.st_size
+        except OSError as e:
+            logging.error(f"Cannot scan '{os.path.join(root, rel_dir)}': {e}")
+
+def page_key(filename, record):
+    """
+    Key of one record of a file: the file key itself, "<key>#p<n>" for the
+    invoices on later pages of a multi-invoice PDF.
+    """
+    page = record.get("page", 1)
+    return filename if page == 1 else f"{filename}#p{page}"
+
+def split_page_key(key):
+    """
+    Returns (file key, page) for a record key made by page_key.
+    """
+    base, sep, page = key.rpartition("#p")
+    if sep and page.isdigit() and base.lower().endswith(".pdf"):
+        return base, int(page)
+    return key, 1
+
+def _rederive_records(index, records, stale, names):
+    """
+    Re-runs the field stage for records made by another EXTRACTOR_VERSION,
+    over their stored text layer. Updates `records` in place and returns
+    (changed [(digest, record, quarter)], unchanged digests). Stale records
+    without a usable text layer are dropped from `records`, so they get re-parsed.
+    names: {digest: file name} passed to the rules.
+    """
+    layers = index.get_texts(stale)
+    changed, unchanged, missing = [], [], 0
+    for digest in stale:
+        blob = layers.get(digest)
+        if blob is None:
+            # Indexed before text layers were stored
+            del records[digest]
+            missing += 1
+            continue
+        try:
+            recs = rederive_invoices(blob, names[digest])
+        except LookupError:
+            # The rules now need pages that were never read
+            del records[digest]
+            missing += 1
+            continue
+        except Exception as e:
+            logging.error(f"Failed to re-derive {names[digest]} from its text layer, re-parsing: {e}")
+            del records[digest]
+            continue
+        for record in recs:
+            record.pop("filename", None)
+        if recs == records[digest]:
+            unchanged.append(digest)
+        else:
+            records[digest] = recs
+            changed += [(digest, record, get_quarter(str(record.get("date")))) for record in recs]
+    logging.info(f"Extractor v{EXTRACTOR_VERSION}: re-derived {len(stale) - missing} files from stored text, "
+                 f"{missing} to re-parse ({len({c[0] for c in changed})} changed).")
+    return changed, unchanged
+
+def _resolve_files(index, input_dir, files, known, workers, chunksize, progress=None, cancel=None, hashed=None,
+                   force=False):
+    """
+    Resolves the given file keys of input_dir to records (tagged with their
+    content digest), parsing what the index does not know yet. Content that
+    timed out, blew the memory cap or crashed its worker is quarantined and
+    resolves to None until it changes. Records made by an older extractor
+    are re-derived from their stored text layer.
+    Returns ({record key: record or None}, index updates as InvoiceIndex.apply()
+    keyword arguments); a multi-invoice PDF resolves to one key per page (page_key).
+    files: {key: (path, mtime, size)} as listed by the caller.
+    hashed: {key: digest} already computed by the caller (e.g. while uploading).
+    force: re-parse every file, ignoring indexed records and quarantine.
+    """
+    hashed = hashed or {}
+    digests = {}
+    changed_files = []
+
+    for filename, (file_path, mtime, size) in files.items():
+        # Cheap pre-check: unchanged mtime + size means the digest is still valid
+        entry = known.get(file_path)
+        if entry and entry[0] == mtime and entry[1] == size:
+            digest = entry[2]
+        else:
+            digest = hashed.get(filename) or file_digest(file_path)
+            changed_files.append((file_path, mtime, size, digest))
+
+        digests[filename] = digest
+
+    records = {} if force else index.get_records(set(digests.values()))
+    new_records, restamped = [], []
+    stale = index.outdated_records(records, EXTRACTOR_VERSION) if records else set()
+    if stale:
+        names = {digests[f]: os.path.basename(files[f][0]) for f in files}
+        new_records, restamped = _rederive_records(index, records, stale, names)
+
+    resolved = {}
+    total = len(files)
+    done = 0
+
+    def settle(filename, digest, recs, cached):
+        nonlocal done
+        done += 1
+        if not recs:
+            resolved[filename] = None
+            if progress:
+                progress(None, done, total, cached)
+            return
+        for rec in recs:
+            record = dict(rec, filename=page_key(filename, rec), digest=digest)
+            resolved[record["filename"]] = record
+            if progress:
+                progress(record, done, total, cached)
+
+    # Extract each distinct uncached content once; quarantined content is skipped
+    held = set() if force else index.quarantined(set(digests.values()) - records.keys())
+    pending = {}  # digest -> filenames sharing that content
     for filename in files:
-        file_path = os.path.join(input_dir, filename)
-        current_files.add(filename)
-        
-        # Check Cache
-        file_stat = os.stat(file_path)
-        last_mod = file_stat.st_mtime
-        file_size = file_stat.st_size
-        
-        # Cache Key: filename (simple) or hash? Filename is fine for now if we track mtime
-        if filename in cache:
-            cached_entry = cache[filename]
-            if cached_entry.get('mtime') == last_mod and cached_entry.get('size') == file_size:
-                # Use cached data
-                if cached_entry.get('data'): # Only add if valid data
-                     data_list.append(cached_entry['data'])
+        digest = digests[filename]
+        if digest in records:
+            FILES_RESOLVED.inc(1, "cache")
+            settle(filename, digest, records[digest], True)
+        elif digest in held:
+            FILES_RESOLVED.inc(1, "quarantined")
+            settle(filename, digest, [], True)
+        else:
+            pending.setdefault(digest, []).append(filename)
+    if held:
+        logging.info(f"Skipped {len(held)} quarantined files (see /api/quarantine).")
+
+    new_texts, quarantined = [], []
+    if pending:
+        paths = [files[names[0]][0] for names in pending.values()]
+        for digest, (res, blob, failure) in zip(pending, _iter_extract(paths, workers, chunksize, cancel)):
+            if failure:
+                kind, reason = failure
+                if kind in QUARANTINE_KINDS:
+                    FILES_QUARANTINED.inc(1, kind)
+                    quarantined.append((digest, files[pending[digest][0]][0], f"{kind}: {reason}"))
+                # Nothing is indexed for the content: a plain error is retried by the next scan
+                for filename in pending[digest]:
+                    settle(filename, digest, [], False)
                 continue
+            FILES_RESOLVED.inc(1, "parsed")
+            if not any(r.get(field) for r in res for field in ("invoice_no", "date", "purchaser", "seller", "total_amount")):
+                EXTRACTION_FAILURES.inc()
+            recs = []
+            for r in res:
+                record = dict(r)
+                record.pop("filename", None)
+                recs.append(record)
+                new_records.append((digest, record, get_quarter(str(record.get("date")))))
+            if blob is not None:
+                new_texts.append((digest, blob))
+            for filename in pending[digest]:
+                settle(filename, digest, recs, False)
+
+    updates = {"files": changed_files, "records": new_records, "texts": new_texts, "restamped": restamped,
+               "quarantined": quarantined, "released": sorted(set(digests.values())) if force else []}
+    return resolved, updates
+
+def scan_directory(input_dir, workers=None, chunksize=None, progress=None, cancel=None):
+    """
+    Scans invoice files (INVOICE_EXTENSIONS) under input_dir (and EXTRA_ROOTS
+    for INPUT_DIR), extracts data, and returns a list of dictionaries.
+    Subfolders are walked unless SCAN_RECURSIVE is off, skipping SCAN_EXCLUDE; each record's "filename" is its key relative
+    to its root, so same-named files in different folders stay apart.
+    Extracted fields are stored in the SQLite index by content digest, so renamed,
+    moved or copied files are never re-parsed; mtime/size decide whether a file
+    needs hashing. Uncached files are parsed across `workers` processes
+    (default SCAN_WORKERS). Output is ordered by filename; each invoice of a
+    multi-invoice PDF is its own record, keyed "<filename>#p<page>" past page 1.
+
+    progress(record, done, total, cached) is called as each file is resolved
+    (record is None for files without data). If the `cancel` event is set, extraction stops
+    and only the files resolved so far are indexed and returned.
+    """
+    workers = SCAN_WORKERS if workers is None else workers
+    chunksize = SCAN_CHUNKSIZE if chunksize is None else chunksize
+
+    started = time.perf_counter()
+    index = get_index()
+    known = {}
+    listed = {}
+    for prefix, root in scan_roots(input_dir):
+        known.update(index.files_under(root))
+        for rel, mtime, size in iter_pdfs(root):
+            listed[prefix + rel] = (os.path.normpath(os.path.join(root, rel)), mtime, size)
+
+    files = dict(sorted(listed.items()))
+    logging.info(f"Starting extraction for {len(files)} files found in '{input_dir}'...")
+
+    resolved, updates = _resolve_files(
+        index, input_dir, files, known, workers, chunksize, progress, cancel
+    )
 
-        # Extract
+    if cancel is not None and cancel.is_set():
+        done = len({split_page_key(key)[0] for key in resolved})
+        logging.info(f"Scan of '{input_dir}' cancelled after {done}/{len(files)} files.")
+
+    # One transaction: upsert changed rows, drop files that disappeared (or are now excluded)
+    current = {path for path, _, _ in files.values()}
+    deleted = [p for p in known if p not in current]
+    if any(updates.values()) or deleted:
         try:
-            # We call the existing extract_invoice_data function
-            # Since this is inside main.py, we can just call it.
-            # But wait, looking at the previous file view, `extract_invoice_data` takes (pdf_path, filename).
-            # Let's assume it exists and is correct.
-            res = extract_invoice_data(file_path) # Adjusted to match likely signature of extract_invoice_data
-            
-            if res:
-                # Add to result
-                data_list.append(res)
-                
-                # Update Cache
-                cache[filename] = {
-                    'mtime': last_mod,
-                    'size': file_size,
-                    'data': res
-                }
-                updated_cache = True
+            index.apply(deleted=deleted, extractor=EXTRACTOR_VERSION, **updates)
         except Exception as e:
-            logging.error(f"Error processing {filename}: {e}")
+            logging.error(f"Failed to update index: {e}")
 
-    # Cleanup Cache (remove deleted files)
-    all_cached_keys = list(cache.keys())
-    for k in all_cached_keys:
-        if k not in current_files:
-            del cache[k]
-            updated_cache = True
+    SCAN_SECONDS.observe(time.perf_counter() - started, "scan")
 
-    # Save Cache
-    if updated_cache:
+    # Merge in filename order, pages in page order (only add if valid data)
+    return [resolved[key] for key in sorted(resolved, key=split_page_key) if resolved[key]]
+
+def update_files(input_dir, filenames, workers=None, chunksize=None, digests=None, force=False):
+    """
+    Re-indexes only the given file keys of input_dir (e.g. reported by a
+    filesystem watcher). Returns {record key: record or None} for the given
+    keys, plus the later-page keys of multi-invoice PDFs; None means the
+    file is gone, excluded or has no data. Known content digests can be
+    passed as {filename: digest} to skip re-hashing. With force, the files
+    are re-parsed even when indexed (and released from quarantine).
+    """
+    workers = SCAN_WORKERS if workers is None else workers
+    chunksize = SCAN_CHUNKSIZE if chunksize is None else chunksize
+
+    started = time.perf_counter()
+    index = get_index()
+    paths = {}
+    for f in filenames:
         try:
-            with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(cache, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logging.error(f"Failed to save cache: {e}")
+            paths[f] = resolve_path(input_dir, f)
+        except ValueError as e:
+            logging.warning(f"Ignoring {f}: {e}")
+
+    existing = {}
+    for f in sorted(paths):
+        if not f.lower().endswith(INVOICE_EXTENSIONS) or key_excluded(f):
+            continue
+        try:
+            st = os.stat(paths[f])
+        except OSError:
+            continue
+        existing[f] = (paths[f], st.st_mtime, st.st_size)
+    known = index.get_files(p for p, _, _ in existing.values())
 
-    return data_list
+    resolved, updates = _resolve_files(
+        index, input_dir, existing, known, workers, chunksize, hashed=digests, force=force
+    )
 
-def process_invoices(input_dir):
+    deleted = [p for f, p in paths.items() if f not in resolved]
+    try:
+        index.apply(deleted=deleted, extractor=EXTRACTOR_VERSION, **updates)
+    except Exception as e:
+        logging.error(f"Failed to update index: {e}")
+
+    SCAN_SECONDS.observe(time.perf_counter() - started, "update")
+    return {**{f: None for f in filenames}, **resolved}
+
+UNKNOWN_PURCHASER = "Unknown Purchaser"
+
+def organized_target(item, ext=".pdf"):
+    """
+    Returns (purchaser folder, quarter, filename) of a record's organized copy:
+    {Purchaser}/{Quarter}/{Last6Digits}-{Seller}-{Amount}{ext}, ext being the
+    source file's extension.
+    """
+    purchaser = item.get("purchaser") or UNKNOWN_PURCHASER
+    quarter = get_quarter(str(item.get("date")))
+    seller = item.get("seller") or "Unknown Seller"
+    invoice_no = item.get("invoice_no") or "000000"
+    amount = item.get("total_amount")
+    amount = f"{float(amount):.2f}" if amount is not None else "0.00"
+
+    # Req: "发票号后6位" (Last 6 digits); if short, "0补足" (pad with 0)
+    inv_str = str(invoice_no)
+    inv_suffix = inv_str[-6:] if len(inv_str) >= 6 else inv_str.zfill(6)
+
+    # Clean names slightly for path safety
+    safe_purchaser = re.sub(r'[\\/*?:"<>|]', "", purchaser).strip()
+    safe_seller = re.sub(r'[\\/*?:"<>|]', "", seller).strip()
+    return safe_purchaser, quarter, f"{inv_suffix}-{safe_seller}-{amount}{ext.lower()}"
+
+def process_invoices(input_dir, data_list=None):
     """
     Scans PDF files, extracts data, and returns an AGGREGATED DataFrame (grouped by Invoice No).
+    Pass data_list (scan_directory output) to aggregate without rescanning.
     """
     import pandas as pd # Ensure pandas is imported here if not globally
-    data_list = scan_directory(input_dir)
+    if data_list is None:
+        data_list = scan_directory(input_dir)
     df = pd.DataFrame(data_list)
     
     if df.empty:
@@ -514,36 +900,25 @@ def process_invoices(input_dir):
     
     return df_final
 
-def main():
+SUMMARY_COLUMNS = ["invoice_no", "purchaser", "seller", "total_amount", "date", "quarter", "count", "filename"]
+
+def main(output_file=None):
+    output_file = output_file or OUTPUT_FILE
     df_final = process_invoices(INPUT_DIR)
     
     if df_final.empty:
         return
 
-    # Export
-    cols = ["invoice_no", "purchaser", "seller", "total_amount", "date", "quarter", "count", "filename"]
+    # Export: streamed row by row (write-only workbook, or CSV/NDJSON by extension)
+    rows = df_final[SUMMARY_COLUMNS].itertuples(index=False, name=None)
     
     try:
-        with pd.ExcelWriter(OUTPUT_FILE, engine='openpyxl') as writer:
-            df_final[cols].to_excel(writer, index=False, sheet_name='Invoices')
-            
-            # Format columns
-            worksheet = writer.sheets['Invoices']
-            for column in worksheet.columns:
-                max_length = 0
-                column = [cell for cell in column]
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except: pass
-                adjusted_width = (max_length + 2)
-                worksheet.column_dimensions[get_column_letter(column[0].column)].width = min(adjusted_width, 50) # Cap width
-                
-        logging.info(f"Successfully exported {len(df_final)} records to {OUTPUT_FILE}")
+        write_summary(output_file, SUMMARY_COLUMNS, rows, format_for(output_file), sheet_name='Invoices')
+        logging.info(f"Successfully exported {len(df_final)} records to {output_file}")
         
     except Exception as e:
-        logging.error(f"Failed to write Excel file: {e}")
+        logging.error(f"Failed to write summary file: {e}")
 
 if __name__ == "__main__":
-    main()
+    setup_logging()
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,218 @@
+import time
+import bisect
+import threading
+
+# Seconds; covers cached lookups (ms) up to cold scans of large folders
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        # Unlabelled counters are exposed (as 0) from the start
+        self._values = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    Gauge read at scrape time from fn() (a number, or {label values: number}).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def collect(self):
+        value = self.fn()
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def collect(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = []
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = (("le", _number(float(bound))),)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            le = (("le", "+Inf"),)
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(float(series[-2]))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines += metric.header()
+            lines += metric.collect()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return registry.register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, fn, labelnames=()):
+    return registry.register(Gauge(name, help, fn, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, help, labelnames, buckets))
+
+
+# --- Process-wide metrics (recorded by main, invoice_index, organizer, app) ---
+
+HTTP_REQUEST_SECONDS = histogram(
+    "lazyfp_http_request_duration_seconds", "HTTP request latency by route (streamed bodies included).",
+    ("method", "route", "status"),
+)
+SCAN_SECONDS = histogram("lazyfp_scan_duration_seconds", "Duration of scan_directory/update_files runs.", ("kind",))
+FILES_RESOLVED = counter(
+    "lazyfp_files_resolved_total", "Files resolved by scans, by source (parsed or index cache hit).", ("source",)
+)
+EXTRACTION_FAILURES = counter(
+    "lazyfp_extraction_failures_total", "Parsed files that yielded no invoice field (text-less, unreadable or failed)."
+)
+FILES_QUARANTINED = counter(
+    "lazyfp_files_quarantined_total", "Files quarantined by extraction, by reason (timeout, memory, crashed).", ("reason",)
+)
+WORKER_RECYCLES = counter(
+    "lazyfp_extract_worker_recycles_total",
+    "Extraction worker processes replaced, by cause (recycled after N files/M MiB, timeout, memory, crashed).", ("cause",)
+)
+INDEX_SECONDS = histogram(
+    "lazyfp_index_io_duration_seconds", "Time spent reading (load) and writing (save) the invoice index.", ("op",)
+)
+ORGANIZE_BYTES = counter(
+    "lazyfp_organize_bytes_total", "Bytes of invoices placed by organize, by placement method.", ("method",)
+)
+EXPORT_BYTES = counter("lazyfp_export_bytes_total", "Bytes of export ZIP archives streamed to clients.")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request into HTTP_REQUEST_SECONDS,
+    labelled by route template (not raw path) to keep cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None)
+            label = ("static" if path == "" else path) if route is not None else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], label, str(status[0]))
@@ -0,0 +1,156 @@
+import os
+import errno
+import fcntl
+import shutil
+import logging
+
+from main import scan_directory, scan_roots, get_index, organized_target
+from metrics import ORGANIZE_BYTES
+
+# ioctl(2) request cloning a whole file (Linux: btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+# "link" | "reflink" | "copy": best placement method to try first
+PLACE_MODE = os.environ.get("LAZYFP_ORGANIZE_MODE", "link")
+_METHODS = ["link", "reflink", "copy"]
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    shutil.copystat(src, dst)
+
+
+def place_file(src, dst, mode=None):
+    """
+    Places src at dst without duplicating data when the filesystem allows:
+    hardlink, then copy-on-write reflink, then a plain copy2.
+    dst is replaced atomically. Returns the method that worked ("link" when
+    dst already is a hardlink to src).
+    """
+    # Already a hardlink to src: renaming another link over it would be a
+    # no-op on POSIX and leave the temp link behind
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return "link"
+    mode = PLACE_MODE if mode is None else mode
+    methods = _METHODS[_METHODS.index(mode):] if mode in _METHODS else _METHODS
+    tmp = f"{dst}.tmp"
+    for method in methods:
+        try:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            if method == "link":
+                os.link(src, tmp)
+            elif method == "reflink":
+                _reflink(src, tmp)
+            else:
+                shutil.copy2(src, tmp)
+            os.replace(tmp, dst)
+            return method
+        except OSError as e:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            # Unsupported here (other device, no CoW, link limit): try the next way
+            if method == "copy" or e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP,
+                                                   errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EACCES):
+                raise
+    raise OSError(f"Could not place {src} at {dst}")
+
+
+def _prune_dirs(path, stop):
+    """
+    Removes empty directories from path up to (not including) stop.
+    """
+    path = os.path.dirname(path)
+    while os.path.normpath(path) != os.path.normpath(stop):
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = os.path.dirname(path)
+
+
+def organize(input_dir, only=None, progress=None):
+    """
+    Mirrors input_dir into input_dir/organized/{Purchaser}/{Quarter}/ incrementally.
+
+    A manifest in the index maps each organized file to the source content
+    (digest) it was placed from. Targets whose content is unchanged are
+    skipped; targets whose source changed or disappeared are removed.
+    only: source paths (already indexed) to organize instead of the whole
+    folder; stale targets are then only removed for those sources.
+    progress(done, total) is called after each target is placed or skipped.
+    """
+    index = get_index()
+    if only is None:
+        scan_directory(input_dir)
+        files = {}
+        for _, root in scan_roots(input_dir):
+            files.update(index.files_under(root))
+    else:
+        files = index.get_files(os.path.normpath(p) for p in only)
+    records = index.get_records({entry[2] for entry in files.values()})
+
+    organized_base = os.path.join(input_dir, "organized")
+
+    # target -> (source, digest); the first source (by path) wins for identical targets
+    wanted = {}
+    # A multi-invoice PDF is placed once per invoice it holds, each under that invoice's name
+    for src_path in sorted(files):
+        digest = files[src_path][2]
+        for record in records.get(digest, ()):
+            safe_purchaser, quarter, new_name = organized_target(record, os.path.splitext(src_path)[1])
+            target = os.path.normpath(os.path.join(organized_base, safe_purchaser, quarter, new_name))
+            wanted.setdefault(target, (src_path, digest))
+
+    manifest = index.organized_entries()
+    placed, removed = [], []
+    counts = {"link": 0, "reflink": 0, "copy": 0}
+    skipped = 0
+    errors = 0
+
+    for done, (target, (src_path, digest)) in enumerate(wanted.items(), 1):
+        entry = manifest.get(target)
+        if entry and entry[1] == digest and os.path.exists(target):
+            skipped += 1
+        else:
+            try:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                method = place_file(src_path, target)
+                counts[method] += 1
+                ORGANIZE_BYTES.inc(files[src_path][1], method)
+                placed.append((target, src_path, digest, method))
+            except Exception as e:
+                logging.error(f"Error organizing {src_path}: {e}")
+                errors += 1
+        if progress:
+            progress(done, len(wanted))
+
+    # Stale: placed earlier, but the source changed, moved away or was deleted
+    stale = manifest.keys() - wanted.keys()
+    if only is not None:
+        stale = {target for target in stale if manifest[target][0] in files}
+    for target in stale:
+        try:
+            if os.path.lexists(target):
+                os.remove(target)
+            _prune_dirs(target, organized_base)
+            removed.append(target)
+        except OSError as e:
+            logging.error(f"Error removing stale {target}: {e}")
+            errors += 1
+
+    index.apply_organized(placed, removed)
+
+    logging.info(
+        f"Organized '{input_dir}': {len(placed)} placed ({counts['link']} linked, {counts['reflink']} reflinked, "
+        f"{counts['copy']} copied), {skipped} unchanged, {len(removed)} stale removed."
+    )
+    return {
+        "message": f"Organized {len(placed)} files ({skipped} unchanged, {len(removed)} stale removed).",
+        "placed": len(placed),
+        "unchanged": skipped,
+        "removed": len(removed),
+        "methods": counts,
+        "errors": errors,
+    }
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+
+from main import extract_invoice_data, INPUT_DIR, INVOICE_EXTENSIONS
+from rules import take_rule_stats, FIELD_ORDER, RULES
+
+PHASES = ["open", "structured", "extract_text", "layout", "spatial", "regex", "other"]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def profile_file(path):
+    """
+    Runs extract_invoice_data on one file. Returns its profile: phase seconds,
+    the rule behind each field, the per-rule stats of this file and the data.
+    """
+    take_rule_stats()  # Start from a clean slate
+    profile = {}
+    t0 = time.perf_counter()
+    data = extract_invoice_data(path, profile=profile)
+    total = time.perf_counter() - t0
+
+    rules = profile.get("rules", 0.0)
+    spatial = profile.get("spatial", 0.0)
+    phases = {
+        "open": profile.get("open", 0.0),
+        "structured": profile.get("structured", 0.0),
+        "extract_text": profile.get("extract_text", 0.0),
+        "layout": profile.get("layout", 0.0),
+        "spatial": spatial,
+        "regex": max(rules - spatial, 0.0),
+    }
+    phases["other"] = max(total - sum(phases.values()), 0.0)
+    return {
+        "file": os.path.basename(path),
+        "total": total,
+        "phases": phases,
+        "sources": profile.get("sources", {}),
+        "error": profile.get("error"),
+        "rules": take_rule_stats(),
+        "data": data,
+    }
+
+
+def profile_corpus(directory, limit=None):
+    files = sorted(f for f in os.listdir(directory) if f.lower().endswith(INVOICE_EXTENSIONS))
+    if limit:
+        files = files[:limit]
+    results = []
+    for i, f in enumerate(files, 1):
+        results.append(profile_file(os.path.join(directory, f)))
+        if i % 100 == 0:
+            logging.info(f"Profiled {i}/{len(files)} files...")
+    return results
+
+
+def summarize(results, top=10):
+    """
+    Aggregates per-file profiles: phase totals and percentiles, which rule
+    produced each field, per-rule cost and hit/win counts, slowest files.
+    """
+    totals = [r["total"] for r in results]
+    grand = sum(totals) or 1e-12
+
+    phases = {}
+    for phase in PHASES:
+        values = [r["phases"][phase] for r in results]
+        phases[phase] = {
+            "seconds": sum(values),
+            "share": sum(values) / grand,
+            "p50_ms": _percentile(values, 50) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000,
+        }
+
+    sources = {field: {} for field in FIELD_ORDER}
+    for r in results:
+        for field in FIELD_ORDER:
+            name = r["sources"].get(field) or "(none)"
+            sources[field][name] = sources[field].get(name, 0) + 1
+
+    rules = {}
+    for r in results:
+        for key, s in r["rules"].items():
+            agg = rules.setdefault(key, {"calls": 0, "hits": 0, "wins": 0, "seconds": 0.0})
+            for k in agg:
+                agg[k] += s[k]
+
+    slowest = sorted(results, key=lambda r: r["total"], reverse=True)[:top]
+    return {
+        "files": len(results),
+        "seconds": sum(totals),
+        "p50_ms": _percentile(totals, 50) * 1000,
+        "p99_ms": _percentile(totals, 99) * 1000,
+        "errors": sum(1 for r in results if r["error"]),
+        "phases": phases,
+        "sources": sources,
+        "rules": rules,
+        "slowest": [
+            {"file": r["file"], "ms": r["total"] * 1000,
+             "phases_ms": {k: v * 1000 for k, v in r["phases"].items()}, "sources": r["sources"]}
+            for r in slowest
+        ],
+    }
+
+
+def print_report(summary):
+    n = summary["files"] or 1
+    print(f"\n{summary['files']} files in {summary['seconds']:.2f}s "
+          f"(p50 {summary['p50_ms']:.1f} ms, p99 {summary['p99_ms']:.1f} ms, {summary['errors']} errors)")
+
+    print("\n--- Time by phase ---")
+    print(f"{'phase':<14} {'total s':>9} {'share':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for phase, p in summary["phases"].items():
+        print(f"{phase:<14} {p['seconds']:>9.3f} {p['share']:>6.1%} {p['p50_ms']:>8.2f} {p['p99_ms']:>8.2f}")
+
+    print("\n--- Rule that produced each field ---")
+    for field, counts in summary["sources"].items():
+        ranked = sorted(counts.items(), key=lambda kv: -kv[1])
+        print(f"{field:<14} " + ", ".join(f"{name} {count / n:.0%}" for name, count in ranked))
+
+    # In chain order, so a rule's cost is read next to what it wins
+    print("\n--- Rules (chain order) ---")
+    print(f"{'rule':<30} {'calls':>7} {'hits':>7} {'wins':>7} {'total ms':>10} {'ms/call':>8} {'ms/win':>9}")
+    for field in FIELD_ORDER:
+        for rule in RULES[field]:
+            key = f"{field}.{rule.name}"
+            s = summary["rules"].get(key)
+            if not s:
+                print(f"{key:<30} {'never ran':>7}")
+                continue
+            ms = s["seconds"] * 1000
+            per_call = ms / s["calls"] if s["calls"] else 0.0
+            per_win = f"{ms / s['wins']:.2f}" if s["wins"] else "-"
+            print(f"{key:<30} {s['calls']:>7} {s['hits']:>7} {s['wins']:>7} {ms:>10.2f} {per_call:>8.3f} {per_win:>9}")
+
+    print("\n--- Slowest files ---")
+    for r in summary["slowest"]:
+        breakdown = ", ".join(f"{k} {v:.1f}" for k, v in r["phases_ms"].items() if v >= 0.05)
+        print(f"{r['ms']:>8.1f} ms  {r['file']}  [{breakdown}]")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Profile extract_invoice_data over a folder: phase times, winning rules, slowest files."
+    )
+    parser.add_argument("directory", nargs="?", default=INPUT_DIR)
+    parser.add_argument("--top", type=int, default=10, help="slowest files to list")
+    parser.add_argument("--limit", type=int, help="profile only the first N files")
+    parser.add_argument("--json", help="write the summary (and per-file profiles) to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    results = profile_corpus(args.directory, args.limit)
+    if not results:
+        print(f"No invoice files found in '{args.directory}'.")
+        return 1
+    summary = summarize(results, args.top)
+    print_report(summary)
+
+    if args.json:
+        summary["per_file"] = [{k: v for k, v in r.items() if k != "rules"} for r in results]
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,458 @@
+import re
+import threading
+from time import perf_counter
+from functools import cached_property
+
+# --- Name cleanup ---
+
+_WS = re.compile(r"[\s\u3000\xa0]+")
+_ALL_DIGITS = re.compile(r"^\d+$")
+_NON_DIGIT = re.compile(r"\D+")
+NAME_ARTIFACTS = ["名称", "购买方", "销售方", "名", "称", "：", ":", "购", "买", "售", "方"]
+
+def clean_name(n):
+    """
+    Cleans and validates company names.
+    Returns None if invalid.
+    """
+    if not n: return None
+    # Remove all whitespace
+    n = _WS.sub("", n)
+    # Remove artifacts
+    for char in NAME_ARTIFACTS:
+         n = n.replace(char, "")
+
+    # Validation
+    if len(n) < 4: return None
+    if _ALL_DIGITS.match(n): return None # All digits
+    if "机器编号" in n or "税务局" in n: return None # Junk
+    return n
+
+# --- Extraction context (derived views are computed on first use) ---
+
+# Page regions used by the spatial fallbacks, as fractions of (width, height)
+REGIONS = {
+    "left": (0, 0.15, 0.55, 0.60),
+    "right": (0.45, 0.15, 1, 0.60),
+    "bottom": (0, 0.60, 1, 0.95),
+}
+
+_NAME_STRICT = re.compile(r"名\s*称\s*[:：]\s*([^\s]+)")
+_NAME_LOOSE = re.compile(r"名\s*称\s*[:：]?\s+([^\s:：]+)")
+_COMPANY_FLAT = re.compile(r"([\u4e00-\u9fa5()（）]{4,20}公司)")
+
+
+class PageLayout:
+    """
+    The characters of one page, pulled out of pdfplumber once as plain
+    (text, x0, top, x1, bottom) tuples. Region text is an in-memory filter
+    plus line assembly, instead of a pdfplumber crop and layout pass per query.
+    """
+
+    # Same defaults as pdfplumber's extract_text()
+    X_TOLERANCE = 3
+    Y_TOLERANCE = 3
+
+    def __init__(self, width, height, chars):
+        self.width = width
+        self.height = height
+        self.chars = chars
+
+    @classmethod
+    def from_page(cls, page):
+        chars = [(c["text"], c["x0"], c["top"], c["x1"], c["bottom"]) for c in page.chars]
+        return cls(page.width, page.height, chars)
+
+    def region_text(self, fractions):
+        """
+        Text of the chars lying fully inside a box given as fractions of the page.
+        """
+        fx0, ftop, fx1, fbottom = fractions
+        x0, top = self.width * fx0, self.height * ftop
+        x1, bottom = self.width * fx1, self.height * fbottom
+        inside = [c for c in self.chars if c[1] >= x0 and c[3] <= x1 and c[2] >= top and c[4] <= bottom]
+        return self.assemble(inside)
+
+    @classmethod
+    def assemble(cls, chars):
+        """
+        Groups chars into lines by `top`, orders each line by x0 and inserts a
+        space where the horizontal gap exceeds X_TOLERANCE.
+        """
+        lines = []
+        for c in sorted(chars, key=lambda c: (c[2], c[1])):
+            if lines and c[2] - lines[-1][0] <= cls.Y_TOLERANCE:
+                lines[-1][1].append(c)
+            else:
+                lines.append((c[2], [c]))
+        out = []
+        for _, line in lines:
+            line.sort(key=lambda c: c[1])
+            parts = []
+            prev_x1 = None
+            for text, cx0, _, cx1, _ in line:
+                if prev_x1 is not None and cx0 > prev_x1 + cls.X_TOLERANCE:
+                    parts.append(" ")
+                parts.append(text)
+                prev_x1 = cx1
+            out.append("".join(parts))
+        return "\n".join(out)
+
+
+class InvoiceText:
+    """
+    The text of one invoice page plus lazily derived views: flattened text,
+    digit string, label matches and spatial region text. The page layout
+    is only pulled from pdfplumber when a spatial rule actually runs.
+    """
+
+    def __init__(self, text, page=None, layout=None):
+        self.text = text
+        self.page = page
+        self.data = {}
+        self.sources = {}  # field -> name of the rule that produced its value
+        self._layout = layout
+        self._regions = {}
+        self.spatial_seconds = 0.0  # layout + region passes, for profiling
+
+    @property
+    def layout(self):
+        if self._layout is None and self.page is not None:
+            self._layout = PageLayout.from_page(self.page)
+        return self._layout
+
+    @cached_property
+    def flat(self):
+        return _WS.sub("", self.text)
+
+    @cached_property
+    def digits(self):
+        return _NON_DIGIT.sub("", self.text)
+
+    @cached_property
+    def strict_names(self):
+        return [m.group(1) for m in _NAME_STRICT.finditer(self.text)]
+
+    @cached_property
+    def loose_names(self):
+        return [m.group(1) for m in _NAME_LOOSE.finditer(self.text)]
+
+    @cached_property
+    def flat_companies(self):
+        return _COMPANY_FLAT.findall(self.flat)
+
+    def region(self, name):
+        """
+        Returns the text inside a named page region ("" without a layout).
+        """
+        if name not in self._regions:
+            t0 = perf_counter()
+            layout = self.layout
+            self._regions[name] = layout.region_text(REGIONS[name]) if layout is not None else ""
+            self.spatial_seconds += perf_counter() - t0
+        return self._regions[name]
+
+# --- Rule engine ---
+
+class Rule:
+    """
+    One extraction step for a field.
+
+    extract(ctx) returns a candidate or None. when(ctx, value, source) gates
+    the rule on the field's current candidate and the rule that produced it.
+    A hit replaces the candidate; if accept(ctx, value) holds, the field is
+    settled and later rules are skipped.
+    """
+
+    __slots__ = ("field", "name", "extract", "when", "accept")
+
+    def __init__(self, field, name, extract, when=None, accept=None):
+        self.field = field
+        self.name = name
+        self.extract = extract
+        self.when = when
+        self.accept = accept
+
+
+def search(pattern, view="text", group=1, convert=None):
+    """
+    Builds an extract function: first match of a compiled pattern in a view.
+    """
+    pattern = re.compile(pattern)
+
+    def extract(ctx):
+        m = pattern.search(getattr(ctx, view))
+        if not m:
+            return None
+        value = m.group(group)
+        return convert(value) if convert else value
+    return extract
+
+# --- Field rules ---
+
+def _to_float(raw):
+    try:
+        return float(raw.replace(',', '').replace("¥", "").replace("￥", ""))
+    except ValueError:
+        return None
+
+def _sane_amount(raw):
+    val = _to_float(raw)
+    if val is not None and val < 100000000: # Sanity check
+        return val
+    return None
+
+def _cn_date(raw):
+    return f"{raw[:4]}年{raw[4:6]}月{raw[6:]}日"
+
+def _ok_invoice_no(value):
+    # 12-digit numbers starting with 0 are invoice *codes* (发票代码), not numbers
+    return bool(value) and not (len(value) == 12 and value.startswith("0"))
+
+_HAS_DIGIT = re.compile(r"\d")
+
+def _valid_date(raw):
+    if not _HAS_DIGIT.search(raw) or len(raw) < 6:
+        return None
+    return raw
+
+_DATE_8 = re.compile(r"(20\d{6})")
+_DATE_DNA = re.compile(r"(20[23]\d)(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])")
+_JIASHUI = re.compile(r"价\s*税\s*合\s*计.*?[¥￥]?\s*([\d,]+\.?\d*)")
+_NUM_20 = re.compile(r"\b\d{20}\b")
+_NUM_8 = re.compile(r"\b(\d{8})\b")
+_COMPANY_LINE = re.compile(r"([^\n]{2,30}公司)")
+_COMPANY_LINE_4 = re.compile(r"([^\n]{4,30}公司)")
+
+def _date_flat_8(ctx):
+    # Aggressive 8-digit date in flat text (20xxMMDD)
+    for d in _DATE_8.findall(ctx.flat):
+        if int(d[4:6]) <= 12 and int(d[6:]) <= 31: # Basic validation
+            return _cn_date(d)
+    return None
+
+def _date_dna(ctx):
+    # "Digital DNA": all digits of the doc joined, handles "2 0 2 2 1 0 1 7"
+    m = _DATE_DNA.search(ctx.digits)
+    return f"{m.group(1)}年{m.group(2)}月{m.group(3)}日" if m else None
+
+def _date_context(raw):
+    raw = raw.replace(" ", "")
+    return _cn_date(raw) if len(raw) == 8 else None
+
+def _jiashui_amount(ctx):
+    m = _JIASHUI.search(ctx.text)
+    if m and "大写" not in m.group():
+        return _to_float(m.group(1))
+    return None
+
+def _first_20_digits(ctx):
+    m = _NUM_20.search(ctx.text)
+    return m.group() if m else None
+
+def _loose_8_digits(ctx):
+    for n in _NUM_8.findall(ctx.text):
+        if not n.startswith("202"):
+            return n
+    return None
+
+def _nth(view, i):
+    def extract(ctx):
+        names = getattr(ctx, view)
+        return names[i] if len(names) > i else None
+    return extract
+
+def _cleaned(raw):
+    return lambda ctx: clean_name(raw(ctx))
+
+def _unlabelled(*raws):
+    """
+    when: none of the earlier name labels matched at all. A label whose
+    value clean_name rejects still ends the label chain: falling through
+    to a looser label could hand the purchaser the seller's name.
+    """
+    return lambda ctx, value, source: all(raw(ctx) is None for raw in raws)
+
+_purchaser_flat = search(r"(?:购)?名称[:：](.+?)(?:销|售|卖|纳税|统一|地址|开户)", "flat")
+_purchaser_strict = _nth("strict_names", 0)
+_seller_flat = search(r"(?:销|售)名称[:：](.+?)(?:买售|纳税|统一|地址|开户|复核|开票)", "flat")
+_seller_strict = _nth("strict_names", 1)
+
+def _spatial_left(ctx):
+    m = _COMPANY_LINE.search(ctx.region("left"))
+    return clean_name(m.group(1).strip()) if m else None
+
+def _spatial_right(ctx):
+    m = _COMPANY_LINE.search(ctx.region("right"))
+    if m:
+        cand = m.group(1).strip()
+        purchaser = ctx.data.get("purchaser")
+        if not purchaser or cand not in purchaser:
+            return clean_name(cand)
+    return None
+
+def _clashes_with_purchaser(cand, purchaser):
+    if not purchaser:
+        return False
+    return cand in purchaser or ("咨询" in cand and "咨询" in purchaser)
+
+def _spatial_bottom(ctx):
+    purchaser = ctx.data.get("purchaser")
+    for m in _COMPANY_LINE_4.finditer(ctx.region("bottom")):
+        cand = m.group(1).strip()
+        if _clashes_with_purchaser(cand, purchaser): continue
+        return clean_name(cand)
+    return None
+
+def _flat_company_seller(ctx):
+    purchaser = ctx.data.get("purchaser")
+    for cand in ctx.flat_companies:
+        if _clashes_with_purchaser(cand, purchaser): continue
+        return cand
+    return None
+
+def _flat_company_purchaser(ctx):
+    return ctx.flat_companies[0] if ctx.flat_companies else None
+
+_truthy = lambda ctx, value: bool(value)
+_unsettled = lambda ctx, value, source: value is None
+_bad_no = lambda ctx, value, source: not _ok_invoice_no(value)
+
+# Ordered per field; fields are resolved in FIELD_ORDER (seller rules read the purchaser)
+RULES = {
+    "invoice_no": [
+        # Correct logic: 20 digit is king for digital invoices.
+        Rule("invoice_no", "flat_label", search(r"发票号码[:：]?\s*(\d{20}|\d{8,12})", "flat"),
+             accept=lambda ctx, v: _ok_invoice_no(v)),
+        # China Mobile statements (对账单): account / group id act as unique IDs
+        Rule("invoice_no", "customer_account", search(r"客户账号[:：]?\s*(\d+)", "flat"),
+             when=_unsettled, accept=lambda ctx, v: _ok_invoice_no(v)),
+        Rule("invoice_no", "group_id", search(r"集团编号[:：]?\s*(\d+)", "flat"),
+             when=_unsettled, accept=lambda ctx, v: _ok_invoice_no(v)),
+        Rule("invoice_no", "label", search(r"发\s*票\s*号\s*码[:：]\s*(\d+)"),
+             when=_unsettled, accept=lambda ctx, v: _ok_invoice_no(v) and len(v) >= 10),
+        Rule("invoice_no", "digits20", _first_20_digits,
+             when=lambda ctx, v, source: source in (None, "label") and (not v or len(v) < 10),
+             accept=lambda ctx, v: _ok_invoice_no(v)),
+        Rule("invoice_no", "flat_haoma", search(r"号码[:：]?(\d{8,20})", "flat"), when=_bad_no),
+        # Unified Invoice Monitor (Older format)
+        Rule("invoice_no", "monitor", search(r"监\s*(\d{8})\b"),
+             when=lambda ctx, v, source: not _ok_invoice_no(v) and (not v or v.startswith("0440"))),
+        Rule("invoice_no", "loose8", _loose_8_digits, when=lambda ctx, v, source: not v),
+    ],
+    "date": [
+        Rule("date", "label", search(r"开\s*票\s*日\s*期[:：]\s*(\S+)", convert=_valid_date)),
+        Rule("date", "flat_cn", search(r"(20\d{2}年\d{1,2}月\d{1,2}日)", "flat")),
+        Rule("date", "flat_8digit", _date_flat_8),
+        Rule("date", "label_context", search(r"开票日期[:：]?\D{0,15}(20\d{2}\s*\d{1,2}\s*\d{1,2})", convert=_date_context)),
+        Rule("date", "digital_dna", _date_dna),
+        Rule("date", "any_cn", search(r"(\d{4}年\d{1,2}月\d{1,2}日)")),
+    ],
+    "total_amount": [
+        Rule("total_amount", "xiaoxie", search(r"小\s*写.*?[¥￥]?\s*([\d,]+\.?\d*)", convert=_to_float),
+             accept=_truthy),
+        Rule("total_amount", "jiashui_heji", _jiashui_amount, when=_unsettled, accept=_truthy),
+        Rule("total_amount", "flat_label", search(r"(小写|价税合计)\D{0,50}([¥￥]?\d+\.?\d{2})", "flat", 2, _sane_amount),
+             accept=_truthy),
+        Rule("total_amount", "cn_currency", search(r"[壹贰叁肆伍陆柒捌玖拾佰仟万亿圆角分整]{2,}\D{0,10}([¥￥]?\d+\.?\d{2})", "flat", 1, _sane_amount),
+             accept=_truthy),
+    ],
+    "purchaser": [
+        # Purchaser Name is between "购名称" and "销名称" or "纳税" (handles spaces in names best)
+        Rule("purchaser", "flat_label", _cleaned(_purchaser_flat)),
+        Rule("purchaser", "strict_label", _cleaned(_purchaser_strict), when=_unlabelled(_purchaser_flat)),
+        Rule("purchaser", "loose_label", _cleaned(_nth("loose_names", 0)),
+             when=_unlabelled(_purchaser_flat, _purchaser_strict)),
+        Rule("purchaser", "spatial_left", _spatial_left),
+        Rule("purchaser", "flat_company", _flat_company_purchaser),
+    ],
+    "seller": [
+        Rule("seller", "flat_label", _cleaned(_seller_flat)),
+        Rule("seller", "strict_label", _cleaned(_seller_strict), when=_unlabelled(_seller_flat)),
+        Rule("seller", "loose_label", _cleaned(_nth("loose_names", 1)),
+             when=_unlabelled(_seller_flat, _seller_strict)),
+        Rule("seller", "spatial_right", _spatial_right),
+        Rule("seller", "spatial_bottom", _spatial_bottom),
+        Rule("seller", "flat_company", _flat_company_seller),
+    ],
+}
+
+FIELD_ORDER = ["invoice_no", "date", "total_amount", "purchaser", "seller"]
+
+# Bump whenever RULES (or main.extract_fields) change what is extracted: indexed
+# records are then re-derived from their stored text layer, without reopening PDFs.
+EXTRACTOR_VERSION = 3
+
+# --- Per-rule statistics ---
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _entry(rule):
+    key = f"{rule.field}.{rule.name}"
+    s = _stats.get(key)
+    if s is None:
+        s = _stats[key] = {"calls": 0, "hits": 0, "wins": 0, "seconds": 0.0}
+    return s
+
+def _record(rule, hit, seconds):
+    with _stats_lock:
+        s = _entry(rule)
+        s["calls"] += 1
+        s["hits"] += hit
+        s["seconds"] += seconds
+
+def _record_win(rule):
+    # The winning call was already counted by _record
+    with _stats_lock:
+        _entry(rule)["wins"] += 1
+
+def rule_stats():
+    """
+    Returns {"field.rule": {calls, hits, wins, seconds}} for this process.
+    hits: the rule produced a candidate; wins: its candidate is the final value.
+    """
+    with _stats_lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+def take_rule_stats():
+    """
+    Returns and resets this process's stats (used to ship them out of workers).
+    """
+    with _stats_lock:
+        taken = dict(_stats)
+        _stats.clear()
+    return taken
+
+def merge_rule_stats(delta):
+    with _stats_lock:
+        for key, d in delta.items():
+            s = _stats.setdefault(key, {"calls": 0, "hits": 0, "wins": 0, "seconds": 0.0})
+            for k in s:
+                s[k] += d[k]
+
+def apply_rules(ctx):
+    """
+    Resolves every field of ctx in FIELD_ORDER. Returns ctx.data.
+    """
+    for field in FIELD_ORDER:
+        value, source = None, None
+        for rule in RULES[field]:
+            if rule.when is not None and not rule.when(ctx, value, source.name if source else None):
+                continue
+            t0 = perf_counter()
+            cand = rule.extract(ctx)
+            elapsed = perf_counter() - t0
+            if cand is None:
+                _record(rule, 0, elapsed)
+                continue
+            value, source = cand, rule
+            settled = rule.accept is None or rule.accept(ctx, value)
+            _record(rule, 1, elapsed)
+            if settled:
+                break
+        if source is not None:
+            _record_win(source)
+        ctx.data[field] = value
+        ctx.sources[field] = source.name if source else None
+    return ctx.data
@@ -0,0 +1,159 @@
+import io
+import csv
+import json
+import pickle
+import tempfile
+
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+FORMATS = ["xlsx", "csv", "ndjson"]
+
+# Same rule as the old autosize pass: longest value + 2, capped
+MAX_COLUMN_WIDTH = 50
+
+
+def _plain(value):
+    """
+    numpy/pandas scalars -> Python values; NaN/None -> None.
+    """
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class ColumnWidths:
+    """
+    Running max text length per column, updated row by row.
+    """
+
+    def __init__(self, count):
+        self.lengths = [0] * count
+
+    def update(self, row):
+        lengths = self.lengths
+        for i, value in enumerate(row):
+            if value is not None:
+                n = len(str(value))
+                if n > lengths[i]:
+                    lengths[i] = n
+
+    def widths(self):
+        return [min(n + 2, MAX_COLUMN_WIDTH) for n in self.lengths]
+
+
+def _spool(rows, widths):
+    """
+    Streams rows into a temporary file while measuring them. Write-only
+    sheets emit column widths before the first row, so the rows are replayed
+    from disk once every width is known; memory stays flat.
+    """
+    spool = tempfile.TemporaryFile()
+    for row in rows:
+        row = [_plain(v) for v in row]
+        widths.update(row)
+        # One self-contained pickle per row (a shared Pickler memo would grow with the file)
+        pickle.dump(row, spool, protocol=pickle.HIGHEST_PROTOCOL)
+    spool.seek(0)
+    return spool
+
+
+def _replay(spool):
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
+
+
+def write_xlsx(target, header, rows, sheet_name="Summary"):
+    """
+    Writes header + rows to target (path or binary file) with openpyxl's
+    write-only mode, with column widths fitted to the content.
+    """
+    widths = ColumnWidths(len(header))
+    widths.update(header)
+    spool = _spool(rows, widths)
+    try:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(sheet_name)
+        for i, width in enumerate(widths.widths(), 1):
+            ws.column_dimensions[get_column_letter(i)].width = width
+        ws.append(list(header))
+        for row in _replay(spool):
+            ws.append(row)
+        wb.save(target)
+    finally:
+        spool.close()
+
+
+def write_csv(target, header, rows):
+    """
+    Writes header + rows as UTF-8 CSV (with BOM, so Excel detects the encoding).
+    """
+    with _text(target) as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(["" if v is None else v for v in map(_plain, row)])
+
+
+def write_ndjson(target, header, rows):
+    """
+    Writes one JSON object per row, keyed by header.
+    """
+    with _text(target, bom=False) as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(header, map(_plain, row))), ensure_ascii=False))
+            f.write("\n")
+
+
+class _text:
+    """
+    Text stream over a path or a binary file; a passed-in file is left open.
+    """
+
+    def __init__(self, target, bom=True):
+        self.target = target
+        self.encoding = "utf-8-sig" if bom else "utf-8"
+
+    def __enter__(self):
+        if isinstance(self.target, (str, bytes)) or hasattr(self.target, "__fspath__"):
+            self.f = open(self.target, "w", encoding=self.encoding, newline="")
+            self.owned = True
+        else:
+            self.f = io.TextIOWrapper(self.target, encoding=self.encoding, newline="")
+            self.owned = False
+        return self.f
+
+    def __exit__(self, *exc):
+        if self.owned:
+            self.f.close()
+        else:
+            self.f.flush()
+            self.f.detach()
+
+
+def write_summary(target, header, rows, fmt="xlsx", sheet_name="Summary"):
+    """
+    Writes one summary table in fmt ("xlsx", "csv" or "ndjson"). rows may be
+    any iterable of sequences; it is consumed once.
+    """
+    if fmt == "xlsx":
+        write_xlsx(target, header, rows, sheet_name)
+    elif fmt == "csv":
+        write_csv(target, header, rows)
+    elif fmt == "ndjson":
+        write_ndjson(target, header, rows)
+    else:
+        raise ValueError(f"Unknown summary format: {fmt} (expected one of {', '.join(FORMATS)})")
+
+
+def format_for(path, default="xlsx"):
+    """
+    Picks the summary format from a file extension (.xlsx, .csv, .ndjson/.jsonl).
+    """
+    ext = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+    return {"xlsx": "xlsx", "csv": "csv", "ndjson": "ndjson", "jsonl": "ndjson"}.get(ext, default)
@@ -0,0 +1,258 @@
+import os
+import time
+import sys
+import signal
+import logging
+import resource
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+# How often busy workers are checked against their deadline and memory cap (seconds)
+POLL_INTERVAL = 0.25
+# Workers in a row that may die before starting any item before supervised_map gives up
+MAX_START_FAILURES = 2
+
+# Highest peak RSS (MiB) any worker started by this process reported (see peak_worker_rss_mb)
+_peak_rss = 0.0
+_peak_lock = threading.Lock()
+
+
+def _context(fn):
+    """
+    Workers are forked from a single-threaded fork server where available:
+    forking the threaded web server directly can hand a child a lock another
+    thread held (stdio, logging), and the child then hangs on its first write.
+    The server preloads __main__ and fn's module, so each worker starts warm.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context()
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(["__main__", fn.__module__])
+    return ctx
+
+
+def rss_mb(pid="self"):
+    """
+    Resident set size of a process in MiB (None where /proc is unavailable).
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _own_peak_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)  # bytes on macOS, KiB on Linux
+
+
+def _note_peak(mb):
+    global _peak_rss
+    if mb is not None:
+        with _peak_lock:
+            _peak_rss = max(_peak_rss, mb)
+
+
+def peak_worker_rss_mb():
+    """
+    Peak RSS in MiB of the busiest worker supervised_map has run in this
+    process. Workers are children of the fork server, not of this process,
+    so RUSAGE_CHILDREN does not see them.
+    """
+    with _peak_lock:
+        return _peak_rss
+
+
+def _worker_main(conn, fn, max_files, recycle_mb, initializer):
+    """
+    Worker loop: runs fn over each chunk of (seq, item) received. Before each
+    item it sends (seq, "started", ...), after it (seq, status, value,
+    retiring, peak RSS in MiB). After a chunk, a worker that has handled
+    max_files items or grown past recycle_mb retires (exits). initializer,
+    if given, runs once first.
+    """
+    # Own process group, so a kill also takes down any pool the task started
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The supervisor decides when workers stop
+    if initializer is not None:
+        initializer()
+    handled = 0
+    while True:
+        try:
+            chunk = conn.recv()
+        except (EOFError, OSError):
+            return
+        if chunk is None:
+            return
+        for i, (seq, item) in enumerate(chunk):
+            conn.send((seq, "started", None, False, None))
+            try:
+                status, value = "ok", fn(item)
+            except Exception as e:
+                status, value = "error", f"{type(e).__name__}: {e}"
+            handled += 1
+            retiring = False
+            if i == len(chunk) - 1:
+                rss = rss_mb()
+                retiring = handled >= max_files or (rss is not None and rss >= recycle_mb)
+            conn.send((seq, status, value, retiring, _own_peak_mb()))
+            if retiring:
+                return
+
+
+class _Worker:
+    def __init__(self, ctx, fn, max_files, recycle_mb, initializer):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child, fn, max_files, recycle_mb, initializer), name="lazyfp-extract")
+        self.proc.start()
+        child.close()
+        self.chunk = []  # (seq, item) sent and not answered yet, in order
+        self.since = None  # When the current item started (last answer or dispatch)
+        self.started = None  # seq of the last item the worker reported starting
+
+    def assign(self, chunk):
+        self.chunk = list(chunk)
+        self.since = time.monotonic()
+        self.conn.send(self.chunk)
+
+    def kill(self):
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            else:
+                self.proc.kill()
+        except (ProcessLookupError, PermissionError):
+            self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join(1)
+        if self.proc.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+def supervised_map(fn, items, workers=1, chunksize=1, cancel=None, timeout=None, rss_limit_mb=None,
+                   max_files=200, recycle_mb=1024, on_recycle=None, initializer=None):
+    """
+    Runs fn(item) for each item in up to `workers` supervised processes,
+    yielding (status, value) in item order:
+    - ("ok", result);
+    - ("error", message): fn raised;
+    - ("timeout" | "memory" | "crashed", reason): the item ran past `timeout`
+      seconds, pushed its worker past rss_limit_mb, or its worker died. The
+      worker is killed (with its process group) and replaced; the rest of its
+      chunk is handed out again.
+    Workers are recycled after max_files items or once their RSS reaches
+    recycle_mb (checked between chunks); on_recycle(cause) is called for each.
+    Each worker runs initializer() (if given) before its first item.
+    Their peak RSS is tracked for peak_worker_rss_mb().
+    A worker that dies (or stalls) before starting its item is not the
+    item's fault: the chunk is handed out again, and after
+    MAX_START_FAILURES such workers in a row OSError is raised, like when
+    no worker can be started at all. Stops early once `cancel` is set.
+    """
+    items = list(items)
+    ctx = _context(fn)
+    queue = deque()
+    for start in range(0, len(items), max(1, chunksize)):
+        queue.append([(seq, items[seq]) for seq in range(start, min(start + max(1, chunksize), len(items)))])
+    results = {}
+    live = []
+    idle = []
+    next_out = 0
+    start_failures = 0
+
+    def fail(worker, kind, reason):
+        nonlocal start_failures
+        worker.kill()
+        live.remove(worker)
+        if worker.started != worker.chunk[0][0]:
+            start_failures += 1
+            if start_failures >= MAX_START_FAILURES:
+                raise OSError(f"extraction workers die before starting any file ({reason})")
+            logging.warning(f"Extraction worker died before starting its file ({reason}), retrying.")
+            queue.appendleft(worker.chunk)
+            return
+        seq, _ = worker.chunk.pop(0)
+        results[seq] = (kind, reason)
+        if worker.chunk:
+            queue.appendleft(worker.chunk)
+        if on_recycle:
+            on_recycle(kind)
+
+    try:
+        while next_out < len(items):
+            if cancel is not None and cancel.is_set():
+                return
+            while queue and idle:
+                worker = idle.pop()
+                if worker.proc.is_alive():
+                    worker.assign(queue.popleft())
+                else:
+                    live.remove(worker)
+                    worker.conn.close()
+            while queue and len(live) < workers:
+                worker = _Worker(ctx, fn, max_files, recycle_mb, initializer)
+                live.append(worker)
+                worker.assign(queue.popleft())
+
+            busy = [w for w in live if w.chunk]
+            wait([w.conn for w in busy] + [w.proc.sentinel for w in busy], timeout=POLL_INTERVAL)
+            now = time.monotonic()
+            for worker in busy:
+                try:
+                    while worker.chunk and worker.conn.poll():
+                        seq, status, value, retiring, peak = worker.conn.recv()
+                        worker.since = now
+                        if status == "started":
+                            worker.started = seq
+                            start_failures = 0
+                            continue
+                        _note_peak(peak)
+                        worker.chunk.pop(0)
+                        results[seq] = (status, value)
+                        if retiring:
+                            worker.proc.join()
+                            worker.conn.close()
+                            live.remove(worker)
+                            if on_recycle:
+                                on_recycle("recycled")
+                            break
+                except (EOFError, OSError):
+                    pass
+                if worker not in live:
+                    continue
+                if not worker.chunk:
+                    idle.append(worker)
+                elif not worker.proc.is_alive():
+                    fail(worker, "crashed", f"worker exited with code {worker.proc.exitcode}")
+                elif timeout and now - worker.since > timeout:
+                    fail(worker, "timeout", f"no result after {timeout:g}s")
+                elif rss_limit_mb:
+                    rss = rss_mb(worker.proc.pid)
+                    _note_peak(rss)
+                    if rss is not None and rss > rss_limit_mb:
+                        fail(worker, "memory", f"worker RSS {rss:.0f} MiB over the {rss_limit_mb} MiB cap")
+
+            while next_out in results:
+                yield results.pop(next_out)
+                next_out += 1
+    finally:
+        for worker in live:
+            if worker.chunk:
+                worker.kill()
+            else:
+                worker.stop()
+        if live:
+            logging.debug(f"Stopped {len(live)} extraction workers.")
@@ -0,0 +1,27 @@
+import sys
+import logging
+
+from main import extract_fields
+
+logging.basicConfig(level=logging.WARNING)
+
+# (text, expected fields): label mixes the rule chain has got wrong before
+CASES = [
+    # The purchaser's label holds junk: the seller's looser "名 称" label must not stand in for it
+    ("购买方\n名称：机器编号1234\n杭州某某网络科技有限公司\n销售方\n名 称： 广州甲乙贸易有限公司\n",
+     {"purchaser": "杭州某某网络科技有限公司", "seller": "广州甲乙贸易有限公司"}),
+    ("购 名称：上海某某科技有限公司\n销 名称：北京某某服务有限公司\n",
+     {"purchaser": "上海某某科技有限公司", "seller": "北京某某服务有限公司"}),
+]
+
+if __name__ == "__main__":
+    failures = 0
+    for text, expected in CASES:
+        data = extract_fields(text, None, "verify.pdf")
+        wrong = {k: data.get(k) for k, v in expected.items() if data.get(k) != v}
+        if wrong:
+            failures += 1
+            print(f"FAILURE: {text!r}\n  expected {expected}\n  got      {wrong}")
+    if failures:
+        sys.exit(1)
+    print(f"SUCCESS: {len(CASES)} cases")
@@ -0,0 +1,246 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT = struct.Struct("iIII")
+
+
+def walk_dirs(directory, recursive=False, skip_dir=None, start=""):
+    """
+    Yields the "/"-separated paths (relative to directory) of start and, when
+    recursive, of every subfolder below it that skip_dir(rel) does not reject.
+    """
+    stack = [start]
+    while stack:
+        rel = stack.pop()
+        yield rel
+        if not recursive:
+            continue
+        try:
+            with os.scandir(os.path.join(directory, rel) if rel else directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        child = f"{rel}/{entry.name}" if rel else entry.name
+                        if skip_dir is None or not skip_dir(child):
+                            stack.append(child)
+        except OSError:
+            pass
+
+
+class DirectoryWatcher(threading.Thread):
+    """
+    Base class: watches one directory on a daemon thread and calls
+    callback(names) with the set of changed entry paths ("/"-separated,
+    relative to directory) once events have been quiet for `debounce`
+    seconds. callback(None) means events were lost and the caller should
+    rescan everything. With recursive=True subfolders are watched too,
+    except those skip_dir(relative path) rejects.
+    """
+
+    def __init__(self, directory, callback, debounce=0.5, recursive=False, skip_dir=None):
+        super().__init__(name=f"watch-{directory}", daemon=True)
+        self.directory = directory
+        self.callback = callback
+        self.debounce = debounce
+        self.recursive = recursive
+        self.skip_dir = skip_dir
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def poll_events(self, timeout):
+        """
+        Waits up to timeout seconds; returns a set of changed names, or None on overflow.
+        """
+        raise NotImplementedError
+
+    def run(self):
+        pending = set()
+        overflow = False
+        last_event = 0.0
+        while not self._stopped.is_set():
+            try:
+                names = self.poll_events(self.debounce)
+            except Exception as e:
+                logging.error(f"Watcher on '{self.directory}' failed: {e}")
+                time.sleep(self.debounce)
+                continue
+            if names is None:
+                overflow = True
+                last_event = time.monotonic()
+            elif names:
+                pending |= names
+                last_event = time.monotonic()
+
+            if (pending or overflow) and time.monotonic() - last_event >= self.debounce:
+                batch, pending = (None if overflow else pending), set()
+                overflow = False
+                try:
+                    self.callback(batch)
+                except Exception as e:
+                    logging.error(f"Watcher callback failed: {e}")
+        self.close()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(DirectoryWatcher):
+    """
+    Linux inotify watcher (via libc, no extra dependency).
+    """
+
+    def __init__(self, directory, callback, debounce=0.5, recursive=False, skip_dir=None):
+        super().__init__(directory, callback, debounce, recursive, skip_dir)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}  # watch descriptor -> relative folder path
+        try:
+            self._watch_tree("")
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def _watch_tree(self, start):
+        """
+        Adds watches for start and (when recursive) the folders below it.
+        """
+        for rel in walk_dirs(self.directory, self.recursive, self.skip_dir, start):
+            path = os.path.join(self.directory, rel) if rel else self.directory
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if not rel:
+                    raise OSError(err, f"inotify_add_watch failed for {path}")
+                logging.warning(f"Cannot watch '{path}': {os.strerror(err)}")
+                continue
+            self._dirs[wd] = rel
+
+    def _files_below(self, start):
+        names = set()
+        for rel in walk_dirs(self.directory, self.recursive, self.skip_dir, start):
+            try:
+                with os.scandir(os.path.join(self.directory, rel)) as entries:
+                    names |= {f"{rel}/{e.name}" for e in entries if e.is_file()}
+            except OSError:
+                pass
+        return names
+
+    def poll_events(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        names = set()
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            parent = self._dirs.get(wd)
+            if not name or parent is None:
+                continue
+            name = os.fsdecode(name)
+            rel = f"{parent}/{name}" if parent else name
+            if mask & IN_ISDIR:
+                if not self.recursive or (self.skip_dir is not None and self.skip_dir(rel)):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # New folder: watch it and report what is already inside
+                    self._watch_tree(rel)
+                    names |= self._files_below(rel)
+                elif mask & IN_MOVED_FROM:
+                    # Its files left without events of their own
+                    return None
+                continue
+            names.add(rel)
+        return names
+
+    def close(self):
+        try:
+            os.close(self._fd)
+        except OSError as e:
+            if e.errno != errno.EBADF:
+                raise
+
+
+class PollingWatcher(DirectoryWatcher):
+    """
+    Portable fallback: diffs a scandir snapshot of (mtime, size) every `interval` seconds.
+    """
+
+    def __init__(self, directory, callback, debounce=0.5, interval=2.0, recursive=False, skip_dir=None):
+        super().__init__(directory, callback, debounce, recursive, skip_dir)
+        self.interval = interval
+        self._state = self._snapshot()
+
+    def _snapshot(self):
+        state = {}
+        for rel in walk_dirs(self.directory, self.recursive, self.skip_dir):
+            try:
+                with os.scandir(os.path.join(self.directory, rel) if rel else self.directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            st = entry.stat()
+                            state[f"{rel}/{entry.name}" if rel else entry.name] = (st.st_mtime, st.st_size)
+            except OSError:
+                if not rel:
+                    raise
+        return state
+
+    def poll_events(self, timeout):
+        if self._stopped.wait(self.interval):
+            return set()
+        current = self._snapshot()
+        previous, self._state = self._state, current
+        return {n for n in previous.keys() | current.keys() if previous.get(n) != current.get(n)}
+
+
+def make_watcher(directory, callback, mode="auto", interval=2.0, recursive=False, skip_dir=None):
+    """
+    Returns an (unstarted) watcher for mode "inotify", "poll" or "auto"
+    (inotify when available, polling otherwise). Returns None for "off".
+    """
+    if mode == "off":
+        return None
+    if mode in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(directory, callback, recursive=recursive, skip_dir=skip_dir)
+        except (OSError, AttributeError) as e:
+            if mode == "inotify":
+                raise
+            logging.info(f"inotify unavailable ({e}), polling '{directory}' every {interval}s")
+    return PollingWatcher(directory, callback, interval=interval, recursive=recursive, skip_dir=skip_dir)
@@ -0,0 +1,206 @@
+import re
+import zlib
+import zipfile
+import logging
+import xml.etree.ElementTree as ET
+
+from defusedxml import DefusedXmlException
+from defusedxml.ElementTree import iterparse
+from pdfminer.pdftypes import resolve1, LITERALS_FLATE_DECODE
+from pdfminer.utils import decode_text
+
+# Element names (or OFD CustomData names) holding each field, most authoritative first.
+# Fully digital invoice XML (数电票), OFD invoice metadata and common Chinese labels.
+FIELD_KEYS = {
+    "invoice_no": ("EIid", "InvoiceNumber", "InvoiceNo", "发票号码"),
+    "date": ("IssueTime", "IssueDate", "RequestTime", "开票日期"),
+    "total_amount": ("TotalTax-includedAmount", "TotalAmountWithTax", "价税合计"),
+    "purchaser": ("BuyerName", "PurchaserName", "购买方名称"),
+    "seller": ("SellerName", "销售方名称"),
+}
+# Pre-tax amount and tax: their sum stands in for a missing total (OFD metadata)
+PART_KEYS = {
+    "amount": ("TotalAmWithoutTax", "合计金额"),
+    "tax": ("TotalTaxAm", "合计税额"),
+}
+
+# OFD members and PDF attachments larger than this are not parsed (zip bombs)
+MAX_MEMBER_SIZE = 16 * 1024 * 1024
+
+_RANKS = {key: (field, rank) for field, keys in {**FIELD_KEYS, **PART_KEYS}.items() for rank, key in enumerate(keys)}
+_DATE = re.compile(r"(\d{4})[-/.年]?(\d{1,2})[-/.月]?(\d{1,2})")
+_PAGE = re.compile(r"Pages/Page_(\d+)/Content\.xml$")
+
+
+def _local(tag):
+    return tag.rpartition("}")[2]
+
+
+def _date(raw):
+    m = _DATE.match(raw)
+    return f"{m.group(1)}年{int(m.group(2)):02d}月{int(m.group(3)):02d}日" if m else None
+
+
+def _amount(raw):
+    try:
+        return float(raw.replace(",", "").lstrip("¥￥"))
+    except ValueError:
+        return None
+
+
+def _convert(field, raw):
+    if field == "date":
+        return _date(raw)
+    if field in ("total_amount", "amount", "tax"):
+        return _amount(raw)
+    return raw
+
+
+def parse_invoice_xml(f):
+    """
+    Streams an invoice XML document (binary file object) with iterparse and
+    returns the fields it holds ({field: value}, only those found). Parsing
+    stops as soon as every field has its preferred element; elements are
+    cleared as they close, so memory stays flat. Malformed XML, and XML
+    declaring entities (expansion bombs), yields what was read before.
+    """
+    found = {}  # field -> (rank, value)
+    try:
+        for _, elem in iterparse(f, events=("end",)):
+            tag = _local(elem.tag)
+            key = elem.get("Name") if tag == "CustomData" else tag
+            hit = _RANKS.get(key)
+            text = (elem.text or "").strip()
+            elem.clear()
+            if hit is None or not text:
+                continue
+            field, rank = hit
+            value = _convert(field, text)
+            if value is not None and (field not in found or rank < found[field][0]):
+                found[field] = (rank, value)
+                if all(found.get(k, (1,))[0] == 0 for k in FIELD_KEYS):
+                    break
+    except ET.ParseError as e:
+        logging.warning(f"Malformed invoice XML: {e}")
+    except DefusedXmlException as e:
+        logging.warning(f"Rejected invoice XML: {e!r}")
+    fields = {field: value for field, (_, value) in found.items() if field in FIELD_KEYS}
+    if "total_amount" not in fields and "amount" in found and "tax" in found:
+        fields["total_amount"] = round(found["amount"][1] + found["tax"][1], 2)
+    return fields
+
+
+def _fill(fields, more):
+    for field, value in more.items():
+        fields.setdefault(field, value)
+    return fields
+
+
+def _members(zf, pattern):
+    return [i for i in zf.infolist() if pattern(i.filename) and i.file_size <= MAX_MEMBER_SIZE]
+
+
+def _ofd_text(zf):
+    """
+    Text of an OFD's pages (TextCode runs, one line per text object), in page order.
+    """
+    pages = sorted(_members(zf, _PAGE.search), key=lambda i: int(_PAGE.search(i.filename).group(1)))
+    lines = []
+    for info in pages:
+        with zf.open(info) as f:
+            try:
+                for _, elem in iterparse(f, events=("end",)):
+                    tag = _local(elem.tag)
+                    if tag == "TextObject":
+                        line = "".join((c.text or "") for c in elem if _local(c.tag) == "TextCode").strip()
+                        if line:
+                            lines.append(line)
+                        elem.clear()
+            except (ET.ParseError, DefusedXmlException) as e:
+                logging.warning(f"Unreadable OFD page {info.filename}: {e!r}")
+    return "\n".join(lines)
+
+
+def parse_ofd(path):
+    """
+    Reads an OFD invoice (a zip of XML documents). Returns (fields, page text):
+    fields come from an attached invoice XML, then the invoice metadata of
+    OFD.xml; page text is only read when fields are still missing, for the
+    text rules to fill the rest ("" otherwise).
+    """
+    fields = {}
+    with zipfile.ZipFile(path) as zf:
+        for info in _members(zf, lambda n: "/Attachs/" in f"/{n}" and n.lower().endswith(".xml")):
+            with zf.open(info) as f:
+                _fill(fields, parse_invoice_xml(f))
+        for info in _members(zf, lambda n: n.lower() == "ofd.xml"):
+            with zf.open(info) as f:
+                _fill(fields, parse_invoice_xml(f))
+        text = "" if len(fields) == len(FIELD_KEYS) else _ofd_text(zf)
+    return fields, text
+
+
+def parse_xml_file(path):
+    """
+    Fields of a standalone invoice XML file.
+    """
+    with open(path, "rb") as f:
+        return parse_invoice_xml(f)
+
+
+def _name(value):
+    value = resolve1(value)
+    if isinstance(value, bytes):
+        return decode_text(value)
+    return getattr(value, "name", None) or (value if isinstance(value, str) else "")
+
+
+def _attachment_data(stream):
+    """
+    Decoded content of an embedded file stream, or None past MAX_MEMBER_SIZE:
+    declared sizes are checked first, and a plain Flate stream is inflated
+    with a cap, so a small compressed bomb is never expanded in full.
+    """
+    params = resolve1(stream.get("Params"))
+    declared = [resolve1(stream.get("Length")), resolve1(params.get("Size")) if isinstance(params, dict) else None]
+    if any(isinstance(n, int) and n > MAX_MEMBER_SIZE for n in declared):
+        return None
+    filters = stream.get_filters()
+    if (stream.rawdata is not None and stream.decipher is None
+            and len(filters) == 1 and filters[0][0] in LITERALS_FLATE_DECODE):
+        try:
+            if len(zlib.decompressobj().decompress(stream.rawdata, MAX_MEMBER_SIZE + 1)) > MAX_MEMBER_SIZE:
+                return None
+        except zlib.error:
+            pass  # Let pdfminer decide what a broken stream yields
+    data = stream.get_data()
+    return data if len(data) <= MAX_MEMBER_SIZE else None
+
+
+def pdf_xml_attachments(doc):
+    """
+    Yields (name, data) for each XML file embedded in a PDF (pdfminer document:
+    the catalog's EmbeddedFiles name tree). Attachments over MAX_MEMBER_SIZE
+    are skipped.
+    """
+    names = resolve1(doc.catalog.get("Names"))
+    root = resolve1(names.get("EmbeddedFiles")) if isinstance(names, dict) else None
+    stack = [root] if isinstance(root, dict) else []
+    while stack:
+        node = stack.pop()
+        stack += [k for k in map(resolve1, resolve1(node.get("Kids")) or []) if isinstance(k, dict)]
+        pairs = resolve1(node.get("Names")) or []
+        for key, spec in zip(pairs[::2], pairs[1::2]):
+            spec = resolve1(spec)
+            if not isinstance(spec, dict):
+                continue
+            name = _name(spec.get("UF") or spec.get("F") or key)
+            ef = resolve1(spec.get("EF"))
+            stream = resolve1(ef.get("UF") or ef.get("F")) if isinstance(ef, dict) else None
+            if not name.lower().endswith(".xml") or stream is None:
+                continue
+            data = _attachment_data(stream)
+            if data is None:
+                logging.warning(f"Skipping oversize PDF attachment {name}")
+                continue
+            yield name, data
@@ -0,0 +1,66 @@
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkSink:
+    """
+    Write-only, non-seekable file object collecting what ZipFile writes until drained.
+    ZipFile sees no tell()/seek() and falls back to data descriptors.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self.written = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self.written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def iter_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    Yields a ZIP archive as byte chunks while it is being written.
+
+    entries: iterable of (arcname, source, compress_type) where source is a
+    file path (read in chunk_size pieces) or bytes. Memory use is bounded by
+    one chunk plus ZIP headers, whatever the archive size.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w") as zf:
+        for arcname, source, compress_type in entries:
+            if isinstance(source, (bytes, bytearray)):
+                zinfo = zipfile.ZipInfo(arcname)
+                zinfo.file_size = len(source)
+                zinfo.compress_type = compress_type
+                with zf.open(zinfo, "w") as dst:
+                    dst.write(source)
+            else:
+                zinfo = zipfile.ZipInfo.from_file(source, arcname)
+                zinfo.compress_type = compress_type
+                with open(source, "rb") as src, zf.open(zinfo, "w") as dst:
+                    while True:
+                        block = src.read(chunk_size)
+                        if not block:
+                            break
+                        dst.write(block)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    data = sink.drain()
+    if data:
+        yield data
+